@@ -0,0 +1,140 @@
+# Benchmark instances for one_all_mosp: generated graphs with 2-4 objectives and saved OSMnx extracts.
+# Every instance is a MultiDiGraph whose arcs carry a "costs" list, with one arc per node pair (key 0).
+import glob
+import math
+import os
+import random
+
+import networkx as nx
+
+
+def _random_costs(G, num_objs, rng, first=None):
+    for u, v, data in G.edges(data=True):
+        costs = [rng.randint(1, 10) for _ in range(num_objs)]
+        if first is not None:
+            costs[0] = first(u, v)
+        data["costs"] = costs
+    return G
+
+
+def grid_graph(side, num_objs, seed=0):
+    '''
+    side x side grid with arcs in both directions and random integer costs.
+    '''
+    G = nx.MultiDiGraph(nx.grid_2d_graph(side, side).to_directed())
+    return _random_costs(G, num_objs, random.Random(seed))
+
+
+def geometric_graph(n, radius, num_objs, seed=0):
+    '''
+    Random geometric graph in the unit square with arcs in both directions. The first objective is the
+    euclidean arc length (scaled by 100), the others are random integers.
+    '''
+    G = nx.MultiDiGraph(nx.random_geometric_graph(n, radius, seed=seed).to_directed())
+    pos = nx.get_node_attributes(G, "pos")
+    return _random_costs(G, num_objs, random.Random(seed), first=lambda u, v: round(100*math.dist(pos[u], pos[v]), 3))
+
+
+def complete_graph(n, num_objs, seed=0):
+    '''
+    Complete directed graph with random integer costs.
+    '''
+    G = nx.MultiDiGraph(nx.complete_graph(n).to_directed())
+    return _random_costs(G, num_objs, random.Random(seed))
+
+
+def random_digraph(n, p, num_objs, seed=0):
+    '''
+    Small random directed graph (each ordered node pair is an arc with probability p) with integer costs from 0,
+    used to check the search against brute force enumeration.
+    '''
+    rng = random.Random(seed)
+    G = nx.MultiDiGraph()
+    G.add_nodes_from(range(n))
+    for u in range(n):
+        for v in range(n):
+            if u != v and rng.random() < p:
+                G.add_edge(u, v, costs=[rng.randint(0, 6) for _ in range(num_objs)])
+    return G
+
+
+def subdivided_graph(G, p, seed=0, max_inner=3):
+    '''
+    Copy of a graph with integer costs in which the arcs between a node pair (one or both directions) are, with
+    probability p, routed through a chain of 1 to max_inner new nodes, like the interstitial nodes of an
+    unsimplified street network. The costs of every arc are split at random integer points along its chain.
+    '''
+    rng = random.Random(seed)
+    H = nx.MultiDiGraph()
+    H.add_nodes_from(G.nodes(data=True))
+    done = set()
+    count = 0
+    for u, v in list(G.edges(keys=False)):
+        if (u, v) in done:
+            continue
+        directions = [(a, b) for a, b in ((u, v), (v, u)) if G.has_edge(a, b, 0)]
+        done.update(directions)
+        if rng.random() >= p:
+            for a, b in directions:
+                H.add_edge(a, b, costs=list(G.edges[a, b, 0]["costs"]))
+            continue
+        inner = [("chain", count + i) for i in range(rng.randint(1, max_inner))]
+        count += len(inner)
+        for a, b in directions:
+            path = [a] + (inner if a == u else inner[::-1]) + [b]
+            splits = []
+            for c in G.edges[a, b, 0]["costs"]:
+                cuts = [0] + sorted(rng.randint(0, int(c)) for _ in inner) + [int(c)]
+                splits.append([y - x for x, y in zip(cuts, cuts[1:])])
+            for i in range(len(path) - 1):
+                H.add_edge(path[i], path[i + 1], costs=[split[i] for split in splits])
+    return H
+
+
+def save_osm_extract(point, dist, path, custom_filter=None):
+    '''
+    Downloads the walking network around point = (lat, lon) and saves it as GraphML for osm_graph.
+    Elevations are not added; osm_graph falls back on a flat graph without them.
+    '''
+    import osmnx
+    G = osmnx.graph_from_point(point, dist=dist, dist_type="bbox", network_type="walk", simplify=False, custom_filter=custom_filter)
+    osmnx.save_graphml(G, path)
+    return path
+
+
+def osm_graph(path):
+    '''
+    Saved OSMnx extract with the running page's objectives in spirit: length, climb (absolute elevation change,
+    0 without elevations) and length along roads that are not pedestrian ways.
+    '''
+    import osmnx
+    G = nx.MultiDiGraph()
+    raw = osmnx.load_graphml(path)
+    G.add_nodes_from(raw.nodes(data=True))
+    pedestrian = {"footway", "pedestrian", "path", "cycleway", "track", "steps"}
+    for u, v, data in raw.edges(keys=False, data=True):
+        if G.has_edge(u, v):
+            continue
+        length = float(data["length"])
+        climb = abs(raw.nodes[v].get("elevation", 0) - raw.nodes[u].get("elevation", 0))
+        highway = data.get("highway", "")
+        highway = highway if isinstance(highway, list) else [highway]
+        road = 0.0 if pedestrian.intersection(highway) else length
+        G.add_edge(u, v, costs=[length, climb, road])
+    return G
+
+
+def osm_instances(directory):
+    '''
+    (name, G, source) for every saved extract (*.graphml) in directory. The source is the node closest
+    to the center of the extract.
+    '''
+    instances = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.graphml"))):
+        G = osm_graph(path)
+        xs = [data["x"] for _, data in G.nodes(data=True)]
+        ys = [data["y"] for _, data in G.nodes(data=True)]
+        cx, cy = sum(xs)/len(xs), sum(ys)/len(ys)
+        source = min(G.nodes, key=lambda v: (G.nodes[v]["x"] - cx)**2 + (G.nodes[v]["y"] - cy)**2)
+        instances.append((os.path.splitext(os.path.basename(path))[0], G, source))
+    return instances
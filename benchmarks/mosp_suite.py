@@ -0,0 +1,194 @@
+# Benchmark suite for one_all_mosp.
+# Runs the exact, the weighted-sum and the chain compressed exact searches on generated and saved OSMnx graphs,
+# reports run time, labels settled, peak memory and Pareto front sizes, writes the results as JSON for regression
+# tracking and checks the searches against brute force enumeration of all simple paths on small graphs.
+# run from the repository root: python -m benchmarks.mosp_suite [--quick] [--osm-dir DIR] [--output FILE]
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+
+import networkx as nx
+import numpy as np
+
+from benchmarks import mosp_instances
+from utilities import chain_compression
+from utilities import one_all_mosp
+
+
+def generated_instances(quick=False):
+    '''
+    (name, G, source) of the generated benchmark graphs. Larger graphs get fewer objectives so that the
+    exact fronts stay tractable.
+    '''
+    instances = []
+    sides = {2: [10, 20, 30], 3: [8, 12, 16], 4: [6, 8, 10]}
+    geometric = {2: [200, 500], 3: [100, 200], 4: [60, 100]}
+    complete = {2: [20, 40], 3: [12, 20], 4: [8, 12]}
+    for num_objs in [2, 3, 4]:
+        for side in sides[num_objs][:1 if quick else None]:
+            instances.append((f"grid-{side}x{side}-{num_objs}obj", mosp_instances.grid_graph(side, num_objs), (0, 0)))
+        #street-like grid whose blocks are split by interstitial nodes, where chain compression pays off
+        side = sides[num_objs][0]
+        instances.append((f"street-grid-{side}x{side}-{num_objs}obj",
+                          mosp_instances.subdivided_graph(mosp_instances.grid_graph(side, num_objs), .7), (0, 0)))
+        for n in geometric[num_objs][:1 if quick else None]:
+            #radius keeps the expected degree around 8
+            radius = float(np.sqrt(8/(np.pi*n)))
+            instances.append((f"geometric-{n}-{num_objs}obj", mosp_instances.geometric_graph(n, radius, num_objs), 0))
+        for n in complete[num_objs][:1 if quick else None]:
+            instances.append((f"complete-{n}-{num_objs}obj", mosp_instances.complete_graph(n, num_objs), 0))
+    return instances
+
+
+def front_sizes(L):
+    #the first label of every node is a placeholder
+    sizes = np.array([len(labels) - 1 for labels in L.values()])
+    return dict(total=int(sizes.sum()), max=int(sizes.max()), mean=float(sizes.mean()))
+
+
+def run(csr, source, engine):
+    '''
+    One search on the compiled graph, timed first and then run again under tracemalloc for its peak memory.
+    The compressed engine is timed without building the compressed graph, which is done once per graph, and
+    its fronts are those of the kept nodes only.
+    '''
+    if engine == "compressed":
+        compressed = chain_compression.ChainCompressedGraph(csr, keep=[source])
+
+        def search(csr, source, stats=None):
+            return compressed.to_all(source, stats=stats)
+    else:
+        search = one_all_mosp.one_to_all_csr if engine == "exact" else one_all_mosp.weighted_sum_to_all
+    stats = {}
+    start = time.perf_counter()
+    L = search(csr, source, stats=stats)
+    seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    search(csr, source)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return dict(engine=engine, seconds=seconds, peak_memory_bytes=peak, labels_settled=stats["labels_settled"],
+                labels_stored=stats["labels_stored"], fronts=front_sizes(L))
+
+
+def brute_force_fronts(G, source, num_objs):
+    '''
+    Pareto front of every node, by enumerating all simple paths from source.
+    :return: dict of node -> sorted list of cost tuples
+    '''
+    fronts = {source: [tuple(num_objs*[0.0])]}
+    for v in G.nodes:
+        if v == source:
+            continue
+        costs = set()
+        for path in nx.all_simple_paths(G, source, v):
+            costs.add(tuple(float(sum(G.edges[path[i], path[i + 1], 0]["costs"][j] for i in range(len(path) - 1)))
+                            for j in range(num_objs)))
+        costs = np.array(sorted(costs)).reshape(-1, num_objs)
+        fronts[v] = [tuple(c) for c in costs[one_all_mosp.pareto_mask(costs)]] if len(costs) > 0 else []
+    return fronts
+
+
+def check_compressed(G, num_objs, expected):
+    '''
+    Compares the chain compressed exact search from node 0 with the brute force fronts at the kept nodes, and
+    checks that the expanded path of every label runs over arcs of G and sums up to the label's costs.
+    '''
+    compressed = chain_compression.ChainCompressedGraph(one_all_mosp.compile_graph(G, num_objs), keep=[0])
+    for v, labels in compressed.to_all(0).items():
+        found = sorted(set(tuple(x.costs) for x in labels[1:]))
+        if found != sorted(expected[v]):
+            raise AssertionError(f"node {v}: compressed front {found} != brute force {sorted(expected[v])}")
+        for x in labels[1:]:
+            path = x.label_list
+            costs = np.sum([G.edges[path[i], path[i + 1], 0]["costs"] for i in range(len(path) - 1)], axis=0)
+            if path[0] != 0 or path[-1] != v or not np.allclose(costs, x.costs):
+                raise AssertionError(f"node {v}: expanded path {path} does not match its label {x.costs}")
+
+
+def check_brute_force(num_graphs=40):
+    '''
+    Compares the exact search with brute force on small random graphs and checks that every weighted-sum
+    label lies on the brute force front. The chain compressed search is checked on the same graphs with
+    some of their arcs split into chains.
+    :return: number of graphs checked
+    '''
+    for seed in range(num_graphs):
+        rng = np.random.default_rng(seed)
+        n = int(rng.integers(4, 9))
+        num_objs = int(rng.integers(2, 5))
+        G = mosp_instances.random_digraph(n, .45, num_objs, seed)
+        csr = one_all_mosp.compile_graph(G, num_objs)
+        expected = brute_force_fronts(G, 0, num_objs)
+
+        L = one_all_mosp.one_to_all_csr(csr, 0)
+        for v, labels in L.items():
+            found = sorted(set(tuple(x.costs) for x in labels[1:]))
+            if found != sorted(expected[v]):
+                raise AssertionError(f"graph {seed}, node {v}: exact front {found} != brute force {sorted(expected[v])}")
+
+        L = one_all_mosp.weighted_sum_to_all(csr, 0)
+        for v, labels in L.items():
+            for x in labels[1:]:
+                if not np.isclose(np.array(expected[v]), x.costs).all(axis=1).any():
+                    raise AssertionError(f"graph {seed}, node {v}: weighted-sum label {x.costs} is not Pareto optimal")
+
+        H = mosp_instances.subdivided_graph(G, .5, seed)
+        try:
+            check_compressed(H, num_objs, brute_force_fronts(H, 0, num_objs))
+        except AssertionError as error:
+            raise AssertionError(f"graph {seed}, {error}") from None
+    return num_graphs
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="one_all_mosp benchmark suite")
+    parser.add_argument("--quick", action="store_true", help="only the smallest instance of each kind")
+    parser.add_argument("--osm-dir", default=os.path.join("benchmarks", "osm"), help="directory of saved OSMnx extracts (*.graphml)")
+    parser.add_argument("--output", default=os.path.join("benchmarks", "results", "mosp.json"), help="JSON results file")
+    parser.add_argument("--engines", nargs="+", default=["exact", "weighted-sum", "compressed"],
+                        choices=["exact", "weighted-sum", "compressed"])
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    checked = check_brute_force(10 if args.quick else 40)
+    print(f"brute force check passed on {checked} graphs ({time.perf_counter() - start:.1f} s)")
+
+    instances = generated_instances(args.quick)
+    if os.path.isdir(args.osm_dir):
+        instances += mosp_instances.osm_instances(args.osm_dir)
+
+    print(f"{'instance':<28} {'engine':<13} {'nodes':>7} {'arcs':>8} {'time (s)':>9} {'settled':>9} {'peak MB':>8} {'front max':>9} {'front mean':>10}")
+    results = []
+    for name, G, source in instances:
+        num_objs = len(next(iter(G.edges(data="costs")))[2])
+        csr = one_all_mosp.compile_graph(G, num_objs)
+        for engine in args.engines:
+            result = run(csr, source, engine)
+            result.update(instance=name, nodes=G.number_of_nodes(), arcs=len(csr.tails), num_objs=num_objs)
+            results.append(result)
+            print(f"{name:<28} {engine:<13} {result['nodes']:>7} {result['arcs']:>8} {result['seconds']:>9.3f} {result['labels_settled']:>9} "
+                  f"{result['peak_memory_bytes']/2**20:>8.1f} {result['fronts']['max']:>9} {result['fronts']['mean']:>10.2f}")
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(dict(created=datetime.datetime.now().isoformat(timespec="seconds"), revision=git_revision(),
+                       python=platform.python_version(), numpy=np.__version__, results=results), f, indent=2)
+    print(f"results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
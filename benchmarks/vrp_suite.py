@@ -0,0 +1,104 @@
+# Benchmark suite for the Trip Planning VRP model (utilities/vrp.py).
+# Solves random capacitated instances of 10, 100 and 1000 stops with the arc costs and demands registered as
+# a matrix and a vector, and with the python transit callbacks the page used before, for comparison. Reports
+# model build and solve times, optionally the improvement curves of time-limited metaheuristic solves, and
+# writes the results as JSON for regression tracking.
+# run from the repository root: python -m benchmarks.vrp_suite [--sizes 10 100 1000] [--metaheuristics ...] [--output FILE]
+import argparse
+import datetime
+import json
+import math
+import os
+import platform
+import time
+
+import numpy as np
+from ortools.constraint_solver import pywrapcp
+
+from benchmarks.mosp_suite import git_revision
+from utilities import vrp
+
+
+def random_instance(n, seed=0, side=20.0):
+    '''
+    n locations uniform in a side x side miles square with euclidean distances, location 0 is the depot.
+    :return: (n, n) distance matrix in miles
+    '''
+    points = np.random.default_rng(seed).uniform(0, side, (n, 2))
+    return np.hypot(*(points[:, None, :] - points[None, :, :]).transpose(2, 0, 1))
+
+
+def callback_model(costs, num_vehicles, capacity, depot=0):
+    #python transit callbacks like the page registered before the matrix model, kept as the baseline
+    costs = np.asarray(costs, dtype=np.int64).tolist()
+    manager = pywrapcp.RoutingIndexManager(len(costs), int(num_vehicles), depot)
+    routing = pywrapcp.RoutingModel(manager)
+
+    def distance_callback(from_index, to_index):
+        return costs[manager.IndexToNode(from_index)][manager.IndexToNode(to_index)]
+    routing.SetArcCostEvaluatorOfAllVehicles(routing.RegisterTransitCallback(distance_callback))
+
+    def demand_callback(from_index, to_index):
+        return 0 if manager.IndexToNode(from_index) == depot else 1
+    routing.AddDimension(routing.RegisterTransitCallback(demand_callback), 0, int(capacity), True, 'capacity')
+    return manager, routing
+
+
+def run(costs, num_vehicles, capacity, model, solution_limit):
+    start = time.perf_counter()
+    build = vrp.build_model if model == "matrix" else callback_model
+    manager, routing = build(costs, num_vehicles, capacity)
+    built = time.perf_counter()
+    solution = routing.SolveWithParameters(vrp.search_parameters(solution_limit=solution_limit))
+    solved = time.perf_counter()
+    return dict(model=model, solution_limit=solution_limit, build_seconds=built - start, solve_seconds=solved - built,
+                objective=solution.ObjectiveValue() if solution else None)
+
+
+def run_metaheuristic(costs, num_vehicles, capacity, metaheuristic, time_limit):
+    manager, routing = vrp.build_model(costs, num_vehicles, capacity)
+    start = time.perf_counter()
+    solution, curve = vrp.solve(routing, time_limit, metaheuristic)
+    return dict(model="matrix", metaheuristic=metaheuristic, time_limit=time_limit, solve_seconds=time.perf_counter() - start,
+                objective=solution.ObjectiveValue() if solution else None, curve=curve)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="VRP model benchmark suite")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[10, 100, 1000], help="number of locations, depot included")
+    parser.add_argument("--capacity", type=int, default=20, help="stops per vehicle")
+    parser.add_argument("--solution-limit", nargs="+", type=int, default=[1, 10], help="solutions the solver may find, 1 is the first solution only")
+    parser.add_argument("--models", nargs="+", default=["matrix", "callback"], choices=["matrix", "callback"])
+    parser.add_argument("--metaheuristics", nargs="*", default=[], choices=list(vrp.metaheuristics), help="time-limited solves to run as well")
+    parser.add_argument("--time-limit", type=float, default=10, help="seconds per metaheuristic solve")
+    parser.add_argument("--output", default=os.path.join("benchmarks", "results", "vrp.json"), help="JSON results file")
+    args = parser.parse_args()
+
+    print(f"{'stops':>6} {'vehicles':>8} {'model':<9} {'limit':>5} {'build (s)':>9} {'solve (s)':>9} {'objective':>10}")
+    results = []
+    for n in args.sizes:
+        costs = vrp.integer_costs(random_instance(n))
+        num_vehicles = max(1, math.ceil((n - 1)/args.capacity))
+        for limit in args.solution_limit:
+            for model in args.models:
+                result = run(costs, num_vehicles, args.capacity, model, limit)
+                result.update(stops=n, vehicles=num_vehicles, capacity=args.capacity)
+                results.append(result)
+                print(f"{n:>6} {num_vehicles:>8} {model:<9} {limit:>5} {result['build_seconds']:>9.3f} {result['solve_seconds']:>9.3f} "
+                      f"{result['objective']/1000 if result['objective'] is not None else float('nan'):>10.1f}")
+        for metaheuristic in args.metaheuristics:
+            result = run_metaheuristic(costs, num_vehicles, args.capacity, metaheuristic, args.time_limit)
+            result.update(stops=n, vehicles=num_vehicles, capacity=args.capacity)
+            results.append(result)
+            print(f"{n:>6} {num_vehicles:>8} {metaheuristic} ({args.time_limit:g} s): {len(result['curve'])} improvements, "
+                  f"objective {result['objective']/1000 if result['objective'] is not None else float('nan'):.1f}")
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(dict(created=datetime.datetime.now().isoformat(timespec="seconds"), revision=git_revision(),
+                       python=platform.python_version(), numpy=np.__version__, results=results), f, indent=2)
+    print(f"results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
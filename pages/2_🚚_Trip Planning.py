@@ -1,3 +1,5 @@
+import functools
+
 import folium
 import numpy as np
 import pandas as pd
@@ -11,14 +13,19 @@ from openrouteservice import distance_matrix, geocode
 from openrouteservice.directions import directions
 from openrouteservice.exceptions import ApiError
 from openrouteservice.geocode import pelias_search
-from ortools.constraint_solver import pywrapcp, routing_enums_pb2
 
 from utilities.utility_functions import decode_polyline
 from utilities import config
+from utilities import geocoding
+from utilities import osm_graph_store
+from utilities import road_matrix
+from utilities import travel_matrix
+from utilities import vrp
 
 # ORS client to be shared among all methods
 client = None
-if config.trip_planning_opts["ors_server"] == "Default":
+#the local routing engine still geocodes with the default server
+if config.trip_planning_opts["ors_server"] in ("Default", "Local"):
     client = openrouteservice.Client(key=st.secrets["ors_key"])
 elif config.trip_planning_opts["ors_server"] == "Default-Personal":
     client = openrouteservice.Client(key=st.session_state["personal-ors-key"])
@@ -32,6 +39,53 @@ def pelias_autocomplete(searchterm: str) -> list[any]:
     #https://github.com/pelias/documentation/blob/master/autocomplete.md
     return [name["properties"]["label"] for name in geocode.pelias_autocomplete(client=client, text=searchterm,country="USA")["features"]]
 
+def ors_matrix(client, profile, locations, sources, destinations):
+    '''
+    One ORS matrix request through the given client, runs on the matrix service's worker threads.
+    :return: (distances, durations) between the given source and destination indices of locations
+    '''
+    matrix = distance_matrix.distance_matrix(
+        client, locations=locations, profile=profile, sources=sources, destinations=destinations,
+        metrics=['distance','duration'], units='mi')
+    return matrix["distances"], matrix["durations"]
+
+@st.cache_resource
+def matrix_service():
+    #pairwise distances and durations are cached per profile across sessions, new pairs are fetched in concurrent tiles.
+    #it holds no client, every call brings the current run's client so each session uses its own key
+    opts = config.trip_planning_opts
+    cache = travel_matrix.PairCache(opts["matrix_cache_path"], opts["matrix_cache_ttl_days"])
+    return travel_matrix.MatrixService(cache, opts["matrix_tile_size"], opts["matrix_max_workers"])
+
+def local_routing():
+    return config.trip_planning_opts["ors_server"] == "Local"
+
+def stop_bbox(nodes):
+    '''
+    Bounding box (north, south, east, west) around the stops, padded and rounded outwards to a grid so
+    nearby sets of stops share one road graph.
+    '''
+    opts = config.trip_planning_opts
+    nodes = np.asarray(nodes, dtype=float).reshape(-1, 2)
+    pad_lat = opts["local_road_buffer_m"]/111320
+    pad_lon = pad_lat/max(np.cos(np.radians(np.abs(nodes[:, 1]).max())), .01)
+    grid = opts["local_road_grid_degrees"]
+    return (float(np.ceil((nodes[:, 1].max() + pad_lat)/grid)*grid), float(np.floor((nodes[:, 1].min() - pad_lat)/grid)*grid),
+            float(np.ceil((nodes[:, 0].max() + pad_lon)/grid)*grid), float(np.floor((nodes[:, 0].min() - pad_lon)/grid)*grid))
+
+@st.cache_resource
+def road_graph_store():
+    #road graphs share the running graphs' store, they are told apart by their network type
+    return osm_graph_store.GraphStore(config.running_opts["graph_store_dir"], config.running_opts["graph_store_max_age_days"])
+
+@st.cache_resource(max_entries=4, show_spinner="Loading Road Network")
+def local_road_matrix(bbox, profile):
+    #loaded once per area and traveller profile, every solve in the area reuses the compiled graph
+    opts = config.trip_planning_opts
+    network_type, speed_kph = opts["local_road_profiles"][profile]
+    G = road_matrix.road_network(bbox, network_type, road_graph_store())
+    return road_matrix.LocalRoadMatrix(G, speed_kph, opts["local_snap_distance_m"])
+
 def query_matrix(nodes):
     '''
     Takes a list of coordinate pairs (lon,lat) and returns matrix based on configured/selected
@@ -39,28 +93,41 @@ def query_matrix(nodes):
     :param nodes:
     :return: matrix of appropriate arc costs
     '''
-
-    matrix = distance_matrix.distance_matrix(
-        client, locations=nodes, profile=st.session_state["matrix_profile"], metrics=['distance','duration'], units='mi')
+    if local_routing():
+        distances, durations = local_road_matrix(stop_bbox(nodes), st.session_state["matrix_profile"]).matrices(nodes)
+    else:
+        #both metrics are cached, so switching the cost metric needs no requests
+        distances, durations = matrix_service().matrices(st.session_state["matrix_profile"], nodes, functools.partial(ors_matrix, client))
     if st.session_state["cost_metric"] == 'distance':
-        return matrix["distances"]
+        return distances.tolist()
     elif st.session_state['cost_metric'] == 'duration':
-        return matrix["durations"]
+        return durations.tolist()
 
 
+def pelias_coordinates(client, location):
+    '''
+    Geocodes one address with pelias through the given client, runs on the geocoder's worker threads.
+    :return: coordinate pair (lon,lat)
+    '''
+    result = pelias_search(client=client, text=location,country="USA") #,boundary_gid=st.session_state["geocoding_region"] #currently not supported
+    #centroid of bounding box of result
+    return [(result["bbox"][0] +result["bbox"][2])/2.0  ,(result["bbox"][1] + result["bbox"][3])/2.0]
+
+@st.cache_resource
+def geocoder():
+    #persistent address cache shared by all sessions, misses are geocoded concurrently under the rate limit.
+    #it holds no client, every call brings the current run's client so each session uses its own key
+    opts = config.trip_planning_opts
+    cache = geocoding.GeocodeCache(opts["geocode_cache_path"], opts["geocode_cache_ttl_days"], opts["geocode_cache_max_entries"])
+    return geocoding.BatchGeocoder(cache, opts["geocode_max_workers"], opts["geocode_requests_per_second"])
+
 def geocode_addresses(addresses):
     '''
     Take a list of addresses and convert to coordinate pairs.
     :param addresses:
     :return: list of coordinate pairs (lon,lat)
     '''
-
-    coordinates = []
-    for location in addresses:
-        result = pelias_search(client=client, text=location,country="USA") #,boundary_gid=st.session_state["geocoding_region"] #currently not supported
-        #centroid of bounding box of result
-        coordinates.append([(result["bbox"][0] +result["bbox"][2])/2.0  ,(result["bbox"][1] + result["bbox"][3])/2.0])
-    return coordinates
+    return geocoder().geocode(addresses, functools.partial(pelias_coordinates, client))
 
 
 def generic_vrp(addresses, depot_index):
@@ -75,101 +142,35 @@ def generic_vrp(addresses, depot_index):
     nodes = geocode_addresses(addresses)
 
     # query cost matrix
-    arc_cost_matrix = query_matrix(nodes=nodes)
-    # Create the routing index manager.
-    manager = pywrapcp.RoutingIndexManager(
-        len(arc_cost_matrix), int(
-            st.session_state['num_vehicles']), depot_index)
-
-    # Create Routing Model.
-    routing = pywrapcp.RoutingModel(manager)
-
-    # Create and register a transit callback.
-    def distance_callback(from_index, to_index):
-        """Returns the distance between the two nodes."""
-        # Convert from routing variable Index to distance matrix NodeIndex.
-        from_node = manager.IndexToNode(from_index)
-        to_node = manager.IndexToNode(to_index)
-        return arc_cost_matrix[from_node][to_node]
-
-    transit_callback_index = routing.RegisterTransitCallback(distance_callback)
-
-    # Define cost of each arc.
-    routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
-
-    # add homogenous vehicle capacity
-    def cb(a,b):
-        if(a != 0 ) & (b != 0):
-            return 1
-        else:
-            #no cost to capacity if depot
-            return 0
-    demand_callback_index = routing.RegisterTransitCallback(cb)
-    routing.AddDimension(demand_callback_index,0,st.session_state["vehicle_capacity"],True,'capacity')
-
-    # Setting first solution heuristic.
-    search_parameters = pywrapcp.DefaultRoutingSearchParameters()
-    search_parameters.first_solution_strategy = (
-        routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC)
-    search_parameters.solution_limit = 1
-
-    # create solutionCollector
-    all_solutions = routing.solver().AllSolutionCollector()
-
-    # give access to node vars
-    for node in range(len(arc_cost_matrix)):
-        all_solutions.Add(routing.NextVar(manager.NodeToIndex(node)))
-
-    for v in range(int(st.session_state["num_vehicles"])):
-        all_solutions.Add(routing.NextVar(routing.Start(v)))
-
-    # add as monitor to solver
-    routing.AddSearchMonitor(all_solutions)
-
-    # Solve the problem.
-    solution = routing.SolveWithParameters(search_parameters)
+    arc_cost_matrix = vrp.integer_costs(query_matrix(nodes=nodes), config.trip_planning_opts["cost_scale"])
+    # Create the routing index manager and model, arc costs and stop demands are evaluated by the solver
+    manager, routing = vrp.build_model(arc_cost_matrix, st.session_state['num_vehicles'],
+                                       st.session_state["vehicle_capacity"], depot_index)
 
-    # give access to objective var
-    all_solutions.AddObjective(routing.CostVar())
-
-    # add as monitor to solver
-    routing.AddSearchMonitor(all_solutions)
-    # Solve the problem fully.
-    search_parameters.solution_limit = 10
-
-    solution = routing.SolveWithParameters(search_parameters)
-    # Print solution on console.
+    # Solve once within the time budget, recording the objective of every improvement
+    solution, curve = vrp.solve(routing, st.session_state["vrp_time_limit"], st.session_state["vrp_metaheuristic"])
     if solution:
-        # initial
         print_solution(
             addresses,
             nodes,
+            arc_cost_matrix,
             manager,
             routing,
-            all_solutions.Solution(
-                all_solutions.SolutionCount() -
-                1))
+            solution)
 
         # chart improvement
-        x = []
-        y = []
-        for i in range(
-                1, all_solutions.SolutionCount()):  # 1 to skip repeat initial
-            x.append(i)
-            y.append(all_solutions.ObjectiveValue(i))
+        x = [seconds for seconds, _ in curve]
+        y = [objective/config.trip_planning_opts["cost_scale"] for _, objective in curve]
 
         if len(y) > 1:
             # plot
             fig, ax = plt.subplots()
-            ax.set_title("Objective vs Metahueristic Iteration")
+            ax.set_title(f"Objective vs Time ({st.session_state['vrp_metaheuristic']})")
 
-            ax.plot(x, y)
-            ax.set_xlabel('Metaheuristic Iteration')
+            ax.step(x, y, where='post')
+            ax.set_xlabel('Seconds')
             ax.set_ylabel('Objective Value')
 
-            #set x ticks to be integer over all iterations
-            plt.xticks(np.arange(1,all_solutions.SolutionCount(),1))
-
             st.session_state['vrp_solution']['improvement'] = fig
         else:
             st.session_state['vrp_solution']['improvement'] = None
@@ -180,54 +181,47 @@ def generic_vrp(addresses, depot_index):
         st.session_state['vrp_solution']['map'] = None
 
 
-def print_solution(addresses, nodes, manager, routing, solution):
-    """Prints solution on console."""
+def print_solution(addresses, nodes, costs, manager, routing, solution):
+    """Prints solution on console.
+    :param costs: integer arc cost matrix the model was built from, see vrp.integer_costs
+    """
     text_solution = []
-    text_solution.append(f'Objective: {solution.ObjectiveValue()}\n')
+    scale = config.trip_planning_opts["cost_scale"]
+    text_solution.append(f'Objective: {solution.ObjectiveValue()/scale}\n')
     max_route_distance = 0
     m = folium.Map()
     routes_all = []
-    for vehicle_id in range(int(st.session_state["num_vehicles"])):
-        index = routing.Start(vehicle_id)
+    colors = config.trip_planning_opts["folium_colors"]
+    for vehicle_id, tour in enumerate(vrp.routes(manager, routing, solution)):
+        #a vehicle that stays at the depot gets no text, no directions request and no line
+        if not routing.IsVehicleUsed(solution, vehicle_id):
+            continue
         plan_output = '**Route for vehicle {}:**\n\n'.format(vehicle_id)
-        route_distance = 0
-        node_coordinates = []
-        while not routing.IsEnd(index):
-            # build input for route
-            if index < len(addresses):
-                node_coordinates.append(
-                    {'index': index, 'coordinates': nodes[manager.IndexToNode(index)]})
-            else:  # set index in dict of artificial depot to 0
-                node_coordinates.append(
-                    {'index': 0, 'coordinates': nodes[manager.IndexToNode(index)]})
-            plan_output += ' {} ️➡️\n'.format(
-                addresses[manager.IndexToNode(index)])
-            previous_index = index
-            index = solution.Value(routing.NextVar(index))
-
-            route_distance += routing.GetArcCostForVehicle(
-                previous_index, index, vehicle_id)
-
-        plan_output += '{}\n'.format(addresses[manager.IndexToNode(index)])
+        for node in tour[:-1]:
+            plan_output += ' {} ️➡️\n'.format(addresses[node])
+        plan_output += '{}\n'.format(addresses[tour[-1]])
         text_solution.append(plan_output)
-        if index < len(addresses):
-            node_coordinates.append(
-                {'index': index, 'coordinates': nodes[manager.IndexToNode(index)]})
-        else:  # set index in dict of artificial depot to 0
-            node_coordinates.append(
-                {'index': 0, 'coordinates': nodes[manager.IndexToNode(index)]})
+        # build input for route, the tour starts and ends at the depot
+        node_coordinates = [{'index': node, 'coordinates': nodes[node]} for node in tour]
+        route_distance = sum(costs[a][b] for a, b in zip(tour, tour[1:]))
         text_solution.append(
-            'Cost of the route: {} \n'.format(route_distance))
+            'Cost of the route: {} \n'.format(route_distance/scale))
         max_route_distance = max(route_distance, max_route_distance)
 
-        route = directions(
-            client=client,
-            coordinates=[
-                x["coordinates"] for x in node_coordinates],
-            profile=st.session_state["matrix_profile"],
-            radiuses=[1000])
-
-        coords = decode_polyline(route["routes"][0]["geometry"], False)
+        if local_routing():
+            #no turn by turn directions, only the geometry
+            coords = local_road_matrix(stop_bbox(nodes), st.session_state["matrix_profile"]).route(
+                [x["coordinates"] for x in node_coordinates])
+        else:
+            route = directions(
+                client=client,
+                coordinates=[
+                    x["coordinates"] for x in node_coordinates],
+                profile=st.session_state["matrix_profile"],
+                radiuses=[1000])
+
+            coords = decode_polyline(route["routes"][0]["geometry"], False)
+            routes_all.append(route)
         # add the nodes
         for i in range(0, len(
                 node_coordinates)):  # -1 because depot included twice once at begin once at end
@@ -239,8 +233,7 @@ def print_solution(addresses, nodes, manager, routing, solution):
             coords,
             weight=5,
             opacity=1,
-            color=config.trip_planning_opts["folium_colors"][vehicle_id]).add_to(m)
-        routes_all.append(route)
+            color=colors[vehicle_id % len(colors)]).add_to(m)
     # create optimal zoom
     nodes_all_df = pd.DataFrame(nodes).rename(
         columns={0: 'Lon', 1: 'Lat'})[['Lat', 'Lon']]
@@ -250,7 +243,7 @@ def print_solution(addresses, nodes, manager, routing, solution):
 
     st.session_state['vrp_solution']['map'] = m
     st.session_state['vrp_solution']['text'] = text_solution
-    st.session_state['vrp_solution']['routes'] = routes_all
+    st.session_state['vrp_solution']['routes'] = None if local_routing() else routes_all
 
 
 def rate_limited_generic_vrp(addresses, depot_index):
@@ -259,9 +252,11 @@ def rate_limited_generic_vrp(addresses, depot_index):
     :param addresses:
     :return:
     '''
-    if len(addresses.index) > config.trip_planning_opts["max_num_nodes"]:
+    #the local routing engine sends no matrix or directions requests, so only the model size limit applies
+    limit = config.trip_planning_opts["max_num_nodes_unlimited"] if local_routing() else config.trip_planning_opts["max_num_nodes"]
+    if len(addresses.index) > limit:
         st.write(
-            f"Your problem instance is larger than the maximum configured size of {config.trip_planning_opts['max_num_nodes']}")
+            f"Your problem instance is larger than the maximum configured size of {limit}")
     else:
         generic_vrp(addresses, depot_index)
 
@@ -269,16 +264,17 @@ def change_route_limit():
     '''
     Callback for addition of personal API key.
     If a trial call with the new key fails, revert to default key.
-    Otherwise, accept the new key and remove the node limit.
+    Otherwise, accept the new key and remove the node limit. A Local deployment keeps routing on its road graph.
     '''
     try:
         directions(openrouteservice.Client(key=st.session_state["personal-ors-key"]),coordinates=[])
-        config.trip_planning_opts["ors_server"] = "Default-Personal"
+        if not local_routing():
+            config.trip_planning_opts["ors_server"] = "Default-Personal"
     except ApiError:
         st.error("API Key is invalid. ")
         return
-    #remove node limit
-    config.trip_planning_opts["max_num_nodes"] = 10000
+    #lift the node limit to what the model handles
+    config.trip_planning_opts["max_num_nodes"] = config.trip_planning_opts["max_num_nodes_unlimited"]
 def main():
     st.set_page_config(
         page_icon="🚚"
@@ -318,6 +314,16 @@ def main():
     # select vehicle capacity
     st.number_input("Vehicle \"Node\" Capacity", key="vehicle_capacity",value=3,step=1)
 
+    # select solve mode and time budget
+    st.selectbox(
+        label="Search Mode",
+        options=list(vrp.metaheuristics),
+        index=list(vrp.metaheuristics).index(config.trip_planning_opts["vrp_metaheuristic"]),
+        key='vrp_metaheuristic',
+        help='metaheuristics improve the first solution until the time limit, first solution stops right away')
+    st.number_input("Time Limit (seconds)", key="vrp_time_limit", value=config.trip_planning_opts["vrp_time_limit"],
+                    min_value=1, step=1)
+
     # select depot
     streamlit_searchbox.st_searchbox(label="Address of Start Location", search_function=pelias_autocomplete,key="VR_Origin")
 
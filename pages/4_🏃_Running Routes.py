@@ -1,6 +1,10 @@
 import datetime
+import functools
+import hashlib
+import itertools
 import math
 import time
+from concurrent.futures import ThreadPoolExecutor
 from random import random
 
 import geopandas
@@ -8,6 +12,7 @@ import networkx as nx
 import numpy as np
 import openrouteservice
 import osmnx as osmnx
+import pandas as pd
 import requests
 import streamlit as st
 import streamlit_folium
@@ -23,7 +28,13 @@ from streamlit_js_eval import get_geolocation
 
 from utilities import config
 
+from utilities import elevation
+from utilities import graph_simplification
+from utilities import loop_routes
 from utilities import one_all_mosp
+from utilities import osm_graph_store
+from utilities import route_cache
+from utilities import route_diversity
 
 #useful tag config
 osmnx.settings.useful_tags_way=['bridge', 'tunnel', 'oneway', 'lanes', 'ref', 'name',
@@ -34,10 +45,22 @@ osmnx.settings.useful_tags_node = ['name','lit','amenity']
 
 osmnx.settings.bidirectional_network_types = ['all']
 
+#downloaded graphs persist across sessions and server restarts
+graph_store = osm_graph_store.GraphStore(config.running_opts["graph_store_dir"], config.running_opts["graph_store_max_age_days"])
+
+#every combination of route preferences, searched ahead of time once a graph is solved
+grade_options = ["Flat","Steep"]
+turn_options = ["Many Turns","Few Turns"]
+preference_options = list(itertools.product(grade_options, turn_options))
+#exact Pareto fronts, or a few weighted-sum shortest path trees for a fast approximation
+engine_options = {"exact": "Exact (all Pareto routes)", "weighted-sum": "Fast (weighted sum)"}
+shape_options = ["Out and Back", "Loop"]
+
 #retrieve client
 # ORS client to be shared among all methods
 client = None
-if config.trip_planning_opts["ors_server"] == "Default":
+#the local routing engine of the Trip Planning page still geocodes with the default server
+if config.trip_planning_opts["ors_server"] in ("Default", "Local"):
     client = openrouteservice.Client(key=st.secrets["ors_key"])
 elif config.trip_planning_opts["ors_server"] == "Default-Personal":
     client = openrouteservice.Client(key=st.session_state["personal-ors-key"])
@@ -57,17 +80,6 @@ def build_cache_support(address, map_mode):
     #build route based on opt criteria
     build_route_mosp(address, map_mode,st.session_state["mileage"])
 
-def route_similarity(routeA,routeB):
-    sim_pct = 0
-    for node in routeA:
-        if node in routeB:
-            sim_pct += 1
-
-    if routeA[-1] != routeB[-1]:
-        return sim_pct/min(len(routeA),len(routeB))
-    else:
-        return sim_pct/min(len(routeA),len(routeB)) + .1 #penalize same dest
-
 # def dominance_check(sol1, sol2):
 #     c = sol1
 #     cc = sol2
@@ -106,116 +118,158 @@ def route_similarity(routeA,routeB):
 #
 #     return sorted_solutions
 
+@st.cache_resource
+def elevation_provider():
+    #local DEM or open-elevation API with a persistent cache, as configured
+    return elevation.provider_from_config(config.running_opts)
+
+@st.cache_resource
+def route_results():
+    #Pareto label sets of past searches, shared by all sessions
+    return route_cache.RouteCache(config.running_opts["route_cache_size"])
+
 @st.cache_data()
 def build_graph(address,map_mode, mileage):
     with st.spinner(text="Requesting Map Data"):
         if map_mode == True:
-            rgs = []
-            rgs_b = []
-            #combine all the filtered data thats requested
-            for x in config.running_opts["osmnx_network_filters"]:
-                rgs.append(osmnx.graph_from_point(address, dist=1.1*mileage*1609.34/2, dist_type='bbox',
-                                                                                                             simplify=False, retain_all=False, truncate_by_edge=False,custom_filter=x))
-                rgs_b.append(osmnx.graph_from_point(address, dist=(1.0*mileage)*1609.34/2, dist_type='bbox',
-                                                                                    simplify=False, retain_all=False, truncate_by_edge=False,custom_filter=x))
-            #compose graphs and save in sess st
-            st.session_state["running_graph"] = nx.compose_all(rgs)
-            st.session_state["running_boundary_graph"] = nx.compose_all(rgs_b)
-
             st.session_state["address_coords"] = address
             st.session_state["select_map"] = False
         else:
-            # query osm
-            rgs = []
-            rgs_b = []
-            for x in config.running_opts["osmnx_network_filters"]:
-                r_i, st.session_state["address_coords"] = osmnx.graph_from_address(address, dist=1.1*mileage*1609.34/2, dist_type='bbox',
-                                                             simplify=False, retain_all=False, truncate_by_edge=False, return_coords=True,custom_filter=x, )
-                rgs.append(r_i)
-                rgs_b.append(osmnx.graph_from_address(address, dist=(1.0*mileage)*1609.34/2, dist_type='bbox',
-                                                                                simplify=False, retain_all=False, truncate_by_edge=False, return_coords=False,custom_filter=x))
-            st.session_state["running_graph"] = nx.compose_all(rgs)
-            st.session_state["running_boundary_graph"] = nx.compose_all(rgs_b)
-
-    with st.spinner(text="Requesting Elevation Data"):
-        attempts = 0
-        while True:
+            st.session_state["address_coords"] = osmnx.geocode(address)
+
+        filters = config.running_opts["osmnx_network_filters"]
+        bbox = osmnx.utils_geo.bbox_from_point(st.session_state["address_coords"], dist=1.1*mileage*1609.34/2)
+        boundary_bbox = osmnx.utils_geo.bbox_from_point(st.session_state["address_coords"], dist=(1.0*mileage)*1609.34/2)
+
+        #clip from a previously downloaded area if one covers the request
+        running_graph = graph_store.get(bbox, filters)
+        downloaded = running_graph is None
+        if downloaded:
+            #one request per filter, issued concurrently, then combine all the filtered data thats requested
+            #(worker threads have no streamlit context, so they must not touch session state)
+            point = st.session_state["address_coords"]
+            def download(x):
+                return osmnx.graph_from_point(point, dist=1.1*mileage*1609.34/2, dist_type='bbox',
+                                              simplify=False, retain_all=False, truncate_by_edge=False,custom_filter=x)
+            with ThreadPoolExecutor(max_workers=len(filters)) as pool:
+                rgs = list(pool.map(download, filters))
+            running_graph = nx.compose_all(rgs)
+        #compose graphs and save in sess st
+        st.session_state["running_graph"] = running_graph
+        #the inner boundary area is cut from the same graph rather than downloaded again
+        north, south, east, west = boundary_bbox
+        st.session_state["running_boundary_graph"] = osmnx.truncate.truncate_graph_bbox(running_graph, north, south, east, west,
+                                                                                       truncate_by_edge=False, retain_all=True)
+        st.session_state["running_csr"] = None
+
+    if downloaded:
+        with st.spinner(text="Requesting Elevation Data"):
             try:
-                attempts = attempts + 1
-                #snippet to add elevation to entire graph.
-                osmnx.elevation.add_node_elevations_google(st.session_state["running_graph"],None,
-                                                       url_template = "https://api.open-elevation.com/api/v1/lookup?locations={}")
-
-                break
-            except:
-                if attempts < 3:
-                    st.error("Elevation Query Failed. Will Re-attempt in 10 seconds")
-                    time.sleep(10) #pause ten seconds and try again
-                else:
-                    st.error("open-elevation.com appears to be experiencing downtime. Please try again later. ")
-                    return
-
-
-
-def type_cost(way):
-    type_cost = 100
-    if "highway" in way:
-        if way["highway"] in ["primary","motorway","primary_link"]:
-            type_cost = 100
-        elif way["highway"] in ["service","residential","unclassified", "tertiary"]:
-            type_cost = 50
-    #prefer cycleways
-
-    if way["highway"]  in ["cycleway","pedestrian","track","footway","path"]:
-        type_cost  = 25
-
-    if "foot" in way:
-        if way["foot"] in ["designated","yes"]:
-            type_cost = 25
-
-    return type_cost*way["length"]
-
-def turn_cost(way):
-    turn_cost = 0
-    if st.session_state["turn_type"] == "Many Turns":
-        turn_cost = min(10000,way["length"])
-    elif st.session_state["turn_type"] == "Few Turns":
-        turn_cost =  max(10000-way["length"],0)
-    return turn_cost
-
-def elevation_cost(node_a, node_b, way):
-    if st.session_state["elevation_type"] == "Flat":
-        return abs((st.session_state["running_graph"].nodes()[node_b]["elevation"]-st.session_state["running_graph"].nodes()[node_a]["elevation"])/way["length"])
-    elif st.session_state["elevation_type"]   == "Steep":
+                #snippet to add elevation to entire graph. failed batches are retried individually by the provider
+                elevation.add_node_elevations(st.session_state["running_graph"], elevation_provider())
+            except Exception:
+                st.error("The elevation service appears to be experiencing downtime. Elevations received so far are saved, please try again later. ")
+                #no route search on a graph without elevations; stopping raises, so the failed call is not cached
+                #and trying again requests only the missing elevations
+                st.session_state["running_graph"] = None
+                st.session_state["running_boundary_graph"] = None
+                st.stop()
+            #only graphs with elevation are stored
+            graph_store.put(bbox, filters, st.session_state["running_graph"])
+
+    #merge the interstitial nodes of every street, routes are searched on and drawn from the merged edges
+    st.session_state["running_graph"] = graph_simplification.simplify_graph(st.session_state["running_graph"])
+
+
+
+def edge_arrays(graph, csr):
+    '''
+    Pulls the edge attributes the route costs depend on into arrays lined up with the arcs of the compiled graph.
+    '''
+    edges = osmnx.graph_to_gdfs(graph, nodes=False, fill_edge_geometry=False)
+    node_ids = np.asarray(csr.node_ids)
+    edges = edges.reindex(pd.MultiIndex.from_arrays([node_ids[csr.tails], node_ids[csr.heads], np.zeros(len(csr.tails), dtype=int)]))
+
+    def tag(name):
+        if name not in edges:
+            return np.full(len(edges), "nan")
+        return edges[name].astype(str).to_numpy()
+
+    return dict(length=edges["length"].to_numpy(dtype=float),
+                highway=tag("highway"),
+                foot=tag("foot"),
+                #elevation gained plus lost along the merged edge
+                climb=(edges["elevation_gain"] + edges["elevation_loss"]).to_numpy(dtype=float))
+
+def edge_costs(arrays, elevation_type, turn_type):
+    '''
+    Elevation, turn and type cost of every arc for one combination of preferences.
+    :return: (arcs, 3) cost matrix
+    '''
+    length = arrays["length"]
+    grade = np.divide(arrays["climb"], length, out=np.zeros_like(length), where=length > 0)
+    if elevation_type == "Flat":
+        elevation_cost = grade
+    else:
         #use 1/grade to prevent negative
+        elevation_cost = 1.0/(grade + .00001)
 
-        return 1.0/(abs((st.session_state["running_graph"].nodes()[node_b]["elevation"]-st.session_state["running_graph"].nodes()[node_a]["elevation"])/way["length"]) + .00001)
+    turn_cost = np.zeros_like(length)
+    if turn_type == "Many Turns":
+        turn_cost = np.minimum(10000, length)
+    elif turn_type == "Few Turns":
+        turn_cost = np.maximum(10000 - length, 0)
+
+    type_cost = np.full_like(length, 100)
+    type_cost[np.isin(arrays["highway"], ["service","residential","unclassified", "tertiary"])] = 50
+    #prefer cycleways
+    type_cost[np.isin(arrays["highway"], ["cycleway","pedestrian","track","footway","path"])] = 25
+    type_cost[np.isin(arrays["foot"], ["designated","yes"])] = 25
+
+    return np.column_stack([elevation_cost, turn_cost, type_cost*length])
+
+def graph_fingerprint(csr, arrays):
+    '''
+    Digest of everything a search on the compiled graph depends on besides the preferences.
+    '''
+    digest = hashlib.sha1()
+    digest.update(np.asarray(csr.node_ids, dtype=np.int64).tobytes())
+    for array in (csr.tails, csr.heads, arrays["length"], arrays["climb"]):
+        digest.update(np.ascontiguousarray(array).tobytes())
+    for array in (arrays["highway"], arrays["foot"]):
+        digest.update("\0".join(array).encode())
+    return digest.hexdigest()
+
+def cached_edge_costs(key):
+    '''
+    Cost matrix of the compiled running graph for the preferences key = (elevation_type, turn_type).
+    The cache lives as long as the compiled graph, so each (graph, elevation_type, turn_type) is only computed once.
+    '''
+    cache = st.session_state["running_cost_cache"]
+    if "arrays" not in cache:
+        cache["arrays"] = edge_arrays(st.session_state["running_graph"], st.session_state["running_csr"])
+        cache["fingerprint"] = graph_fingerprint(st.session_state["running_csr"], cache["arrays"])
+    if key not in cache:
+        cache[key] = edge_costs(cache["arrays"], *key)
+    return cache[key]
 
 def trim_route(label):
-    new_rt = []
-    new_rt.append(label.label_list[0])
-    total_dist = 0
-    total_cost = len(label.costs)*[0]
-    for i in range(1,len(label.label_list)):
-        new_rt.append(label.label_list[i])
-        print(label.label_list[i])
-        total_dist += st.session_state["running_graph"][new_rt[-2]][new_rt[-1]][0]["length"]*2
-        total_cost += label.costs
-        if total_dist/1609.34 > st.session_state["mileage"]:
-            break
-    label.label_list = new_rt.copy()
-    return label
+    #routes are out and back, cut the path where it passes half the desired mileage
+    return label.trim(st.session_state["mileage"]*1609.34/2)
 
 
 def build_route_mosp(address,map_mode, mileage):
     if st.session_state["running_graph"] is None:
         build_graph(address, map_mode,mileage+.01)
     with st.spinner("Computing Routes"):
-        for u, v, data in st.session_state["running_graph"].edges(data=True):
-            data["costs"] = [elevation_cost(u,v,data),
-                             turn_cost(data),
-                             type_cost(data)
-                             ]
+        #compile the graph for the search once, later solves only swap in new costs
+        if st.session_state["running_csr"] is None:
+            st.session_state["running_csr"] = one_all_mosp.compile_graph(st.session_state["running_graph"], 3, cost_attr=None)
+            st.session_state["running_cost_cache"] = {}
+        #cost matrices are computed here, the background searches must not read session state
+        costs = {key: cached_edge_costs(key) for key in preference_options}
+        lengths = st.session_state["running_cost_cache"]["arrays"]["length"]
+        fingerprint = st.session_state["running_cost_cache"]["fingerprint"]
         # set source and sink
         source_return = osmnx.nearest_nodes(st.session_state["running_graph"],st.session_state["address_coords"][1],st.session_state["address_coords"][0])
         #get node ids that are on the last graph 1-mi of the considered area
@@ -230,37 +284,54 @@ def build_route_mosp(address,map_mode, mileage):
         result = list(result)
         #-----------
 
-        L = one_all_mosp.one_to_all(st.session_state["running_graph"],source_return,3)
-
+        #out and back routes need no label extended past half the desired mileage, loops search half of it from each side
+        budget = mileage*1609.34/2
+        csr = st.session_state["running_csr"]
+        engine = one_all_mosp.weighted_sum_to_all if st.session_state["route_engine"] == "weighted-sum" else one_all_mosp.one_to_all_csr
+        loop = st.session_state["route_shape"] == "Loop"
+        def search(key):
+            if loop:
+                return loop_routes.loop_routes(csr.with_costs(costs[key]),source_return,lengths,2*budget,
+                                               tolerance=config.running_opts["loop_length_tolerance"],search=engine)
+            return engine(csr.with_costs(costs[key]),source_return,resource=lengths,budget=budget)
+        #results are reused for the same graph, start and mileage; toggling a preference back is a lookup
+        cache = route_results()
+        preferences = (st.session_state["elevation_type"], st.session_state["turn_type"])
+        search_key = (fingerprint, source_return, budget, st.session_state["route_engine"], st.session_state["route_shape"])
+        L = cache.get(search_key + (preferences,), functools.partial(search, preferences))
+        #search the other preference combinations in the background so switching to them is instant
+        for key in preference_options:
+            cache.prefetch(search_key + (key,), functools.partial(search, key))
+
+        if loop:
+            #loops come back cheapest first and already have the desired length
+            candidates = L
+        else:
+            candidates = []
+            for labels in L.values():
+                reached = [x for x in labels if x.resource >= budget]
+                if len(reached) > 0:
+                    #each node holds its whole Pareto front, keep the label with the lowest total cost
+                    candidates.append(min(reached, key=lambda x: sum(x.costs)))
+            if len(candidates) == 0:
+                #no path reached the budget within the map, fall back on the nodes in the outer ring
+                candidates = [min(L[node], key=lambda x: sum(x.costs)) for node in result if node in L]
+            candidates = sorted((trim_route(label) for label in candidates), key=lambda x: sum(x.costs))
+
+        #keep the 10 cheapest routes that are not too similar to a cheaper one. every loop ends at the start,
+        #so only out and back routes are penalized for sharing their last node
+        selected = route_diversity.select_diverse((label.label_list for label in candidates), 10, config.running_opts["similarity_pct"],
+                                                  same_end_penalty=0 if loop else .1)
         results = []
-        for label in L.values():
-            label = label[-1]
-            if label.node in result:
-                label = trim_route(label)
-                if len(results) > 0:
-                    add = True
-                    for x in results:
-                        if route_similarity(x[-1],label.label_list) < config.running_opts["similarity_pct"]:
-                            continue
-                        else:
-                            add = False
-                            break
-                    if add:
-                        length_m = 0
-                        for i in range(0,len(label.label_list)-1):
-                            length_m += st.session_state["running_graph"][label.label_list[i]][label.label_list[i+1]][0]["length"]*2
-
-                        results.append([st.session_state["running_graph"].subgraph(label.label_list),source_return,label.node,label.costs,length_m,label.label_list])
-                else:
-                    label = trim_route(label)
-                    length_m = 0
-                    for i in range(0,len(label.label_list)-1):
-                        length_m += st.session_state["running_graph"][label.label_list[i]][label.label_list[i+1]][0]["length"]*2
-                    results.append([st.session_state["running_graph"].subgraph(label.label_list),source_return,label.node,label.costs,length_m,label.label_list])
-
-        #results = pareto_sort(results)
-        results = sorted(results, key = lambda x:sum(x[3]))
-        results = results[0:10]
+        for label in (candidates[i] for i in selected):
+            if loop:
+                route = label.label_list
+                length_m = label.resource
+            else:
+                #out and back, reverse shortest path nodes list and append
+                route = label.label_list + label.label_list[::-1][1:]
+                length_m = label.resource*2
+            results.append([st.session_state["running_graph"].subgraph(label.label_list),source_return,label.node,label.costs,length_m,route])
 
         st.session_state["running_route_results"] = results
         st.session_state["route_iter"] = 0
@@ -312,7 +383,7 @@ def main():
         page_icon="🏃"
     )
 
-    state_vars = ['running_graph', 'address_coords', 'sub', 'source', 'sink', 'length_running', 'route', 'running_route_results', 'route_iter']
+    state_vars = ['running_graph', 'running_csr', 'running_cost_cache', 'address_coords', 'sub', 'source', 'sink', 'length_running', 'route', 'running_route_results', 'route_iter']
 
     for var in state_vars:
         if var not in st.session_state:
@@ -324,8 +395,11 @@ def main():
     with st.sidebar:
         st.subheader("Optimization Preferences")
 
-        st.radio("Grade Preference", ["Flat","Steep"],key="elevation_type")
-        st.radio("Turn Preference", ["Many Turns","Few Turns"],key="turn_type")
+        st.radio("Grade Preference", grade_options,key="elevation_type")
+        st.radio("Turn Preference", turn_options,key="turn_type")
+        st.radio("Route Shape", shape_options,key="route_shape")
+        st.selectbox("Route Engine", list(engine_options), index=list(engine_options).index(config.running_opts["route_engine"]),
+                     format_func=engine_options.get, key="route_engine")
         st.write("Greenways, sidewalks, and other pedestrian-friendly paths are preferred by default. ")
 
 
@@ -377,32 +451,22 @@ def main():
         cola.button(label=":arrow_backward:", on_click=route_minus)
         colc.button(label=":arrow_forward:", on_click=route_plus)
 
-        sub = st.session_state["running_route_results"][st.session_state["route_iter"]][0]
         map_location = st.container()
 
+        #full route, out and back routes are already mirrored
         route = st.session_state["running_route_results"][st.session_state["route_iter"]][5]
-        nodes, edges = osmnx.graph_to_gdfs(sub, nodes=True, node_geometry=True)
+        #follow the geometry of the merged edges so every original node is drawn and profiled
+        route_points, route_distances = graph_simplification.route_profile(st.session_state["running_graph"], route)
 
-        #out and back, reverse shortest path nodes list and append
-        route_2 = route.copy()
-        route_2.reverse()
-        route = route + route_2
-        route_nodes = nodes.loc[route]
-
-        route_line = LineString([(point.x, point.y, point.elevation) for point in route_nodes.itertuples()])
+        route_line = LineString(route_points)
 
         gdf1 = geopandas.GeoDataFrame(geometry=[route_line], crs=osmnx.settings.default_crs)
         #check to ensure no length/origin parameter changes
         if str(gdf1["geometry"][0]) != "LINESTRING EMPTY":
-            elevation = route_nodes['elevation'].values*3.28084
-
-            # Calculate cumulative distance
-            distances = [0]
-            for i in range(0, len(route)-1):
-                try:
-                    distances.append(st.session_state["running_graph"].edges[route[i],route[i+1],0]["length"]/1609.34+distances[-1])
-                except:
-                    distances.append(distances[-1]+0)
+            elevation = route_points[:,2]*3.28084
+
+            # cumulative distance in miles
+            distances = route_distances/1609.34
             # Plot elevation over distance using fig, ax style
             fig, ax = plt.subplots(figsize=(7,4))
             ax.plot(distances, elevation, marker='o', linestyle='-')
@@ -415,7 +479,7 @@ def main():
             ax.grid(True)
 
             st.pyplot(fig)
-            st.write(f'Total Distance Out and Back: {np.round(st.session_state["running_route_results"][st.session_state["route_iter"]][4]/1609.34,2)} mi') #meter to mile conversion
+            st.write(f'Total Distance: {np.round(st.session_state["running_route_results"][st.session_state["route_iter"]][4]/1609.34,2)} mi') #meter to mile conversion
             st.write(f"**Elevation Cost**: {round(st.session_state['running_route_results'][st.session_state['route_iter']][3][0],2)}")
             st.write(f"**Turn Cost**: {round(st.session_state['running_route_results'][st.session_state['route_iter']][3][1],2)}")
             st.write(f"**Type Cost**: {round(st.session_state['running_route_results'][st.session_state['route_iter']][3][2],2)}")
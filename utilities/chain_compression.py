@@ -0,0 +1,179 @@
+# Topology compression of CSRGraph snapshots for repeated one_all_mosp queries.
+# Street networks downloaded with simplify=False are mostly chains of degree-2 nodes. Such a node can never be
+# the only way to reach anything, so every chain is replaced by one arc carrying the summed cost vector (and
+# resource) of its arcs. Searches run on the much smaller graph and their labels are expanded back onto the
+# original arcs afterwards, so paths, prefixes and trimming work exactly as on the original graph.
+import numpy as np
+
+from utilities import one_all_mosp
+
+
+def contractible_nodes(csr, keep=()):
+    '''
+    Nodes that sit in the middle of a chain: exactly two distinct neighbors, and every arc into the node
+    continues to the other neighbor.
+    :param keep: node ids that are never contracted, e.g. query sources
+    :return: boolean array over the nodes of csr
+    '''
+    n = len(csr.node_ids)
+    contractible = np.zeros(n, dtype=bool)
+    for v in range(n):
+        outs = csr.heads[csr.out_indptr[v]:csr.out_indptr[v+1]].tolist()
+        ins = csr.tails[csr.in_arcs[csr.in_indptr[v]:csr.in_indptr[v+1]]].tolist()
+        neighbors = set(outs) | set(ins)
+        if len(neighbors) != 2 or v in neighbors or len(outs) != len(set(outs)) or len(ins) != len(set(ins)):
+            continue
+        a, b = neighbors
+        other = {a: b, b: a}
+        if all(other[x] in outs for x in ins) and all(other[y] in ins for y in outs):
+            contractible[v] = True
+    for v in keep:
+        contractible[csr.node_index[v]] = False
+    return contractible
+
+
+def _chains(csr, contractible):
+    '''
+    Walks every chain from a kept node to the next kept node, which may be the node it started from.
+    :return: list of arc index lists, one per chain
+    '''
+    chains = []
+    for u in np.flatnonzero(~contractible):
+        for a in range(csr.out_indptr[u], csr.out_indptr[u+1]):
+            arcs = [a]
+            previous, w = u, csr.heads[a]
+            while contractible[w]:
+                for b in range(csr.out_indptr[w], csr.out_indptr[w+1]):
+                    if csr.heads[b] != previous:
+                        break
+                arcs.append(b)
+                previous, w = w, csr.heads[b]
+            chains.append(arcs)
+    return chains
+
+
+class ChainCompressedGraph:
+    '''
+    CSRGraph with its degree-2 chains contracted. csr is the compressed snapshot over the kept nodes; its arc i
+    stands for the original arcs arcs[arc_indptr[i]:arc_indptr[i+1]], in path order. Chains that would become
+    parallel arcs keep one of their inner nodes so a pair of kept nodes is joined by at most one arc, which lets
+    a label's arc be recovered from its node and its predecessor's node. Likewise a chain that comes back to
+    its start (a loop trail hanging off one node) keeps its middle node, and a cycle with no kept node at all
+    keeps one of its nodes, so no street is lost.
+    The original snapshot must not have parallel arcs either, as compile_graph guarantees.
+    :param keep: node ids that must stay in the compressed graph, e.g. the sources that will be queried
+    '''
+    def __init__(self, original, keep=()):
+        self.original = original
+        contractible = contractible_nodes(original, keep)
+        while True:
+            chains = _chains(original, contractible)
+            ends = {}
+            split = False
+            #direct arcs first, so of two parallel chains the one with inner nodes is split
+            for arcs in sorted(chains, key=len):
+                pair = (original.tails[arcs[0]], original.heads[arcs[-1]])
+                if pair[0] == pair[1] and len(arcs) > 1:
+                    contractible[original.heads[arcs[(len(arcs) - 1)//2]]] = False
+                    split = True
+                elif pair in ends:
+                    contractible[original.heads[arcs[0]]] = False
+                    split = True
+                else:
+                    ends[pair] = arcs
+            #contractible nodes no chain passes through form cycles of their own
+            covered = np.zeros(len(contractible), dtype=bool)
+            for arcs in chains:
+                covered[original.heads[arcs[:-1]]] = True
+            isolated = np.flatnonzero(contractible & ~covered)
+            if len(isolated) > 0:
+                contractible[isolated[0]] = False
+                split = True
+            if not split:
+                break
+
+        #compressed node k is original node kept[k]; chains are ordered by tail so the CSRGraph keeps their order
+        self.kept = np.flatnonzero(~contractible)
+        index = np.full(len(original.node_ids), -1, dtype=np.int64)
+        index[self.kept] = np.arange(len(self.kept))
+        chains = sorted(chains, key=lambda arcs: index[original.tails[arcs[0]]])
+        self.arc_indptr = np.concatenate([[0], np.cumsum([len(arcs) for arcs in chains])]).astype(np.int64)
+        self.arcs = np.array([a for arcs in chains for a in arcs], dtype=np.int64)
+        tails = index[original.tails[self.arcs[self.arc_indptr[:-1]]]] if len(chains) > 0 else np.zeros(0, dtype=np.int64)
+        heads = index[original.heads[self.arcs[self.arc_indptr[1:] - 1]]] if len(chains) > 0 else np.zeros(0, dtype=np.int64)
+        self.csr = one_all_mosp.CSRGraph([original.node_ids[v] for v in self.kept], tails, heads, self.arc_sums(original.costs))
+        self._pairs = self.csr.tails*len(self.kept) + self.csr.heads
+
+    def arc_sums(self, values):
+        '''
+        Per-arc values of the original snapshot (array or (arcs, k) matrix) summed over every compressed arc.
+        '''
+        values = np.asarray(values, dtype=np.float64)
+        if len(self.arcs) == 0:
+            return np.zeros((0,) + values.shape[1:])
+        return np.add.reduceat(values[self.arcs], self.arc_indptr[:-1], axis=0)
+
+    def expand(self, store, resource=None):
+        '''
+        LabelStore over the original graph holding the labels of a search on csr. Label i of store keeps
+        index i; the labels of the inner chain nodes are appended behind them and linked in between.
+        :param resource: the per-arc resource of the original snapshot used in the search, if any
+        '''
+        size = store.size
+        nodes = self.kept[store.nodes[:size]]
+        predecessors = store.predecessors[:size].copy()
+        extended = np.flatnonzero(predecessors >= 0)
+        #the arc of every extended label, from its own and its predecessor's compressed node
+        pairs = store.nodes[predecessors[extended]]*len(self.kept) + store.nodes[extended]
+        order = np.argsort(self._pairs)
+        arcs = order[np.searchsorted(self._pairs, pairs, sorter=order)]
+        inner = self.arc_indptr[arcs + 1] - self.arc_indptr[arcs] - 1
+
+        #positions of the inner arcs within self.arcs, in path order per extended label
+        count = int(inner.sum())
+        starts = np.repeat(self.arc_indptr[arcs], inner)
+        offsets = np.arange(count) - np.repeat(np.cumsum(inner) - inner, inner)
+        positions = starts + offsets
+        owners = np.repeat(extended, inner)
+
+        #cumulative costs and resource from the start of each chain
+        costs = self.original.costs[self.arcs]
+        first = np.repeat(np.arange(len(self.arc_indptr) - 1), np.diff(self.arc_indptr))
+        chain_costs = np.cumsum(costs, axis=0)
+        chain_costs -= (chain_costs - costs)[self.arc_indptr[:-1]][first]
+        if resource is None:
+            resource = np.zeros(len(self.original.tails))
+        lengths = np.asarray(resource, dtype=np.float64)[self.arcs]
+        chain_resources = np.cumsum(lengths)
+        chain_resources -= (chain_resources - lengths)[self.arc_indptr[:-1]][first]
+
+        new = size + np.arange(count)
+        new_nodes = self.original.heads[self.arcs[positions]]
+        new_costs = store.costs[predecessors[owners]] + chain_costs[positions]
+        new_resources = store.resources[predecessors[owners]] + chain_resources[positions]
+        new_predecessors = np.where(offsets == 0, predecessors[owners], new - 1)
+        #the compressed label now follows the last inner label of its chain
+        last = np.cumsum(inner) - 1
+        has_inner = inner > 0
+        predecessors[extended[has_inner]] = new[last[has_inner]]
+
+        return one_all_mosp.LabelStore.from_arrays(self.original.node_ids,
+                                                   np.concatenate([store.costs[:size], new_costs]),
+                                                   np.concatenate([nodes, new_nodes]),
+                                                   np.concatenate([predecessors, new_predecessors]),
+                                                   np.concatenate([store.resources[:size], new_resources]))
+
+    def to_all(self, source, search=one_all_mosp.mosp_search, stats=None, resource=None, budget=one_all_mosp.infinity):
+        '''
+        Searches from the node with id source on the compressed graph. Without a budget the fronts of the kept
+        nodes are those of the uncompressed search. With a budget they can differ: the budget is only checked
+        at kept nodes, so a label crosses a whole chain where the uncompressed search would stop inside it.
+        :param search: one_all_mosp.mosp_search or one_all_mosp.weighted_sum_search
+        :param stats: optional dict, filled by the search on the compressed graph
+        :param resource: per-arc resource of the original snapshot, summed along the chains for the search
+        :return: dict of kept node id -> list of Labels like one_to_all_csr, with paths over the original graph
+        '''
+        compressed_resource = None if resource is None else self.arc_sums(resource)
+        store, L = search(self.csr, self.csr.node_index[source], stats=stats, resource=compressed_resource, budget=budget)
+        store = self.expand(store, resource)
+        return {self.csr.node_ids[v]: [one_all_mosp.Label(store, label) for label in labels] for v, labels in enumerate(L)}
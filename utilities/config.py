@@ -24,7 +24,7 @@ two_var_color_defaults = dict(
 
 # Vehicle Routing options
 trip_planning_opts = dict(
-    ors_server='Default',  # options [Default,insert/url/here]
+    ors_server='Default',  # options [Default,Local,insert/url/here], Local computes matrices and routes on a downloaded road graph
     ors_matrix_profile_opts=['driving-car',
                              'foot-walking',
                              'cycling-regular',
@@ -34,7 +34,11 @@ trip_planning_opts = dict(
                              'driving-hgv',
                              'foot-hiking',
                              'wheelchair'],
-    max_num_nodes=8,
+    max_num_nodes=8, # node limit with the shared API key
+    max_num_nodes_unlimited=2000, # node limit with a personal key or the Local server, solve times are in benchmarks/vrp_suite.py
+    cost_scale=1000, # arc costs are multiplied by this and rounded to integers for the solver, keeps 3 decimals of miles or seconds
+    vrp_metaheuristic="guided local search", # default search mode, options [guided local search, tabu search, simulated annealing, first solution]
+    vrp_time_limit=5, # default solve time budget in seconds
     folium_colors=[
         'red',
         'blue',
@@ -56,7 +60,28 @@ trip_planning_opts = dict(
         'black'
     ] , # colors to rotate through for tours. these are all possible
     cost_metrics =
-    ['distance','duration']
+    ['distance','duration'],
+    geocode_cache_path = ".geocode_cache.sqlite", # geocoded addresses are kept here across sessions
+    geocode_cache_ttl_days = 90, # cached addresses older than this are geocoded again
+    geocode_cache_max_entries = 10000, # least recently used addresses are evicted beyond this
+    geocode_max_workers = 4, # concurrent geocoding requests
+    geocode_requests_per_second = 1.5, # shared rate limit of the geocoding requests
+    matrix_cache_path = ".matrix_cache.sqlite", # pairwise distances and durations are kept here across sessions
+    matrix_cache_ttl_days = 30, # cached pairs older than this are fetched again
+    matrix_tile_size = 50, # most sources and destinations per matrix request, tile_size**2 must be within the server's limit
+    matrix_max_workers = 4, # concurrent matrix requests
+    local_road_profiles = {'driving-car': ('drive', None),
+                           'driving-hgv': ('drive', None),
+                           'foot-walking': ('walk', 5.0),
+                           'foot-hiking': ('walk', 4.0),
+                           'wheelchair': ('walk', 3.0),
+                           'cycling-regular': ('bike', 16.0),
+                           'cycling-electric': ('bike', 22.0),
+                           'cycling-mountain': ('bike', 13.0),
+                           'cycling-road': ('bike', 24.0)}, # osmnx network type and constant speed (km/h) of each profile for the Local server, None uses the imputed road speeds
+    local_road_buffer_m = 2000, # the local road graph extends this far beyond the stops
+    local_road_grid_degrees = .05, # local road graph bounds are rounded out to this grid so nearby stops share a graph
+    local_snap_distance_m = 1000, # stops farther than this from the local road graph are rejected
 )
 
 
@@ -76,7 +101,17 @@ running_opts = dict(
     max_iterations = 1000,
     acceptable_variance_from_best = 5,
     similarity_pct=.9,
-    tabu_list_length=50
+    tabu_list_length=50,
+    graph_store_dir = ".osm_graph_store", # downloaded running graphs are kept here across restarts
+    graph_store_max_age_days = 30, # stored graphs older than this are downloaded again
+    elevation_provider = "open-elevation", # options [open-elevation, raster]
+    elevation_url_template = "https://api.open-elevation.com/api/v1/lookup?locations={}",
+    elevation_cache_path = ".elevation_cache.sqlite", # answers of the elevation API are kept here
+    elevation_max_workers = 4, # concurrent requests to the elevation API
+    elevation_raster_path = "", # local DEM GeoTIFF in EPSG:4326 for the raster provider, reading it requires rasterio
+    route_cache_size = 16, # route searches (graph, start, mileage, preferences) kept in memory for reuse
+    route_engine = "exact", # default route engine, options [exact, weighted-sum]
+    loop_length_tolerance = .1, # accepted relative deviation of a loop route from the desired mileage
 
 )
 
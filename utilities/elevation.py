@@ -0,0 +1,214 @@
+# Node elevation providers for the running graphs.
+# A provider turns arrays of latitudes and longitudes into an array of elevations (meters). The raster
+# provider samples a local DEM, the HTTP provider queries an open-elevation compatible API and remembers
+# every answer in a persistent cache so a coordinate is only ever requested once.
+import json
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import networkx as nx
+import numpy as np
+import requests
+
+from utilities import sqlite_cache
+
+
+class RasterElevationProvider:
+    '''
+    Samples a local DEM GeoTIFF (north-up, single band) with bilinear interpolation.
+    The band is converted once to a .npy file next to the raster and then memory mapped, so only
+    the pages around the sampled nodes are ever read. rasterio is only needed for that conversion.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.array_path = path + ".npy"
+        self.meta_path = path + ".json"
+        if not os.path.exists(self.array_path) or os.path.getmtime(self.array_path) < os.path.getmtime(path):
+            self._convert()
+        with open(self.meta_path) as f:
+            meta = json.load(f)
+        #affine transform (a, b, c, d, e, f): x = c + col*a, y = f + row*e
+        self.transform = meta["transform"]
+        self.nodata = meta["nodata"]
+        self.band = np.load(self.array_path, mmap_mode="r")
+
+    def _convert(self):
+        try:
+            import rasterio
+        except ImportError:
+            raise ImportError("rasterio is required to read a DEM GeoTIFF (pip install rasterio)")
+        with rasterio.open(self.path) as dataset:
+            if dataset.crs is not None and dataset.crs.to_epsg() != 4326:
+                raise ValueError(f"{self.path} must be in EPSG:4326 (lat/lon)")
+            np.save(self.array_path, dataset.read(1).astype(np.float32))
+            meta = dict(transform=list(dataset.transform)[:6], nodata=dataset.nodata)
+        with open(self.meta_path, "w") as f:
+            json.dump(meta, f)
+
+    def elevations(self, lats, lons):
+        '''
+        :return: elevations, nan for points outside the raster and where a neighboring pixel has no data
+        '''
+        a, b, c, d, e, f = self.transform
+        rows, cols = self.band.shape
+        #fractional pixel coordinates relative to pixel centers
+        x = (np.asarray(lons, dtype=float) - c)/a - 0.5
+        y = (np.asarray(lats, dtype=float) - f)/e - 0.5
+        #points in the outer half of an edge pixel are still on the raster and take the edge value
+        outside = (x < -0.5) | (x > cols - 0.5) | (y < -0.5) | (y > rows - 0.5)
+        x = np.clip(x, 0, cols - 1)
+        y = np.clip(y, 0, rows - 1)
+        x0 = np.minimum(np.floor(x).astype(np.int64), max(cols - 2, 0))
+        y0 = np.minimum(np.floor(y).astype(np.int64), max(rows - 2, 0))
+        x1 = np.minimum(x0 + 1, cols - 1)
+        y1 = np.minimum(y0 + 1, rows - 1)
+        wx = x - x0
+        wy = y - y0
+
+        corners = [self.band[y0, x0], self.band[y0, x1], self.band[y1, x0], self.band[y1, x1]]
+        corners = [np.asarray(z, dtype=float) for z in corners]
+        if self.nodata is not None:
+            corners = [np.where(z == self.nodata, np.nan, z) for z in corners]
+        top = corners[0]*(1 - wx) + corners[1]*wx
+        bottom = corners[2]*(1 - wx) + corners[3]*wx
+        return np.where(outside, np.nan, top*(1 - wy) + bottom*wy)
+
+
+class ElevationCache(sqlite_cache.SQLiteCache):
+    '''
+    Persistent coordinate -> elevation cache in SQLite. Coordinates are rounded to 5 decimals (about a meter).
+    '''
+    def __init__(self, path):
+        super().__init__(path, "CREATE TABLE IF NOT EXISTS elevation (lat INTEGER, lon INTEGER, elevation REAL, PRIMARY KEY (lat, lon))")
+
+    @staticmethod
+    def keys(lats, lons):
+        return list(zip(np.round(np.asarray(lats, dtype=float)*1e5).astype(np.int64).tolist(),
+                        np.round(np.asarray(lons, dtype=float)*1e5).astype(np.int64).tolist()))
+
+    def get_many(self, keys):
+        '''
+        :return: dict of the cached keys -> elevation
+        '''
+        found = {}
+        with self.transaction() as connection:
+            for lat, lon, value in self.select_keys(connection, "SELECT lat, lon, elevation FROM elevation WHERE {}",
+                                                    "(lat = ? AND lon = ?)", list(set(keys))):
+                found[(lat, lon)] = value
+        return found
+
+    def put_many(self, values):
+        '''
+        :param values: dict of key -> elevation
+        '''
+        with self.transaction() as connection:
+            connection.executemany("INSERT OR REPLACE INTO elevation VALUES (?, ?, ?)",
+                                   [(lat, lon, value) for (lat, lon), value in values.items()])
+
+
+class HTTPElevationProvider:
+    '''
+    Queries an open-elevation compatible lookup API for the coordinates missing from the cache.
+    Missing coordinates are split into batches whose URL stays under max_url_length, fetched
+    concurrently, and each failed batch is retried on its own with exponential backoff.
+    :param url_template: URL with a {} placeholder for "lat,lon|lat,lon|..."
+    '''
+    def __init__(self, url_template, cache, max_url_length=2000, max_workers=4, max_attempts=4, backoff=1.0, timeout=60):
+        self.url_template = url_template
+        self.cache = cache
+        self.max_url_length = max_url_length
+        self.max_workers = max_workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.timeout = timeout
+
+    @staticmethod
+    def location(key):
+        return f"{key[0]/1e5:.5f},{key[1]/1e5:.5f}"
+
+    def batches(self, keys):
+        '''
+        Splits coordinate keys into batches whose request URL is at most max_url_length long.
+        '''
+        batches = []
+        batch = []
+        length = len(self.url_template)
+        for key in keys:
+            #separators are sent percent-encoded (%7C)
+            size = len(self.location(key)) + 3
+            if len(batch) > 0 and length + size > self.max_url_length:
+                batches.append(batch)
+                batch = []
+                length = len(self.url_template)
+            batch.append(key)
+            length += size
+        if len(batch) > 0:
+            batches.append(batch)
+        return batches
+
+    def fetch(self, keys):
+        '''
+        Elevations of rounded coordinate keys straight from the API.
+        '''
+        locations = "|".join(self.location(key) for key in keys)
+        response = requests.get(self.url_template.format(locations), timeout=self.timeout)
+        response.raise_for_status()
+        results = response.json()["results"]
+        if len(results) != len(keys):
+            raise ValueError(f"expected {len(keys)} elevations, received {len(results)}")
+        return {key: result["elevation"] for key, result in zip(keys, results)}
+
+    def fetch_with_retry(self, keys):
+        for attempt in range(self.max_attempts):
+            try:
+                batch = self.fetch(keys)
+                break
+            except (requests.RequestException, ValueError, KeyError):
+                if attempt == self.max_attempts - 1:
+                    raise
+                #exponential backoff with jitter so parallel retries do not hit the service together
+                time.sleep(self.backoff*2**attempt*(1 + random.random()))
+        #store each batch as it arrives so a failure elsewhere keeps these results
+        self.cache.put_many(batch)
+        return batch
+
+    def elevations(self, lats, lons):
+        keys = ElevationCache.keys(lats, lons)
+        found = self.cache.get_many(keys)
+        missing = list({key for key in keys if key not in found})
+
+        failed = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = [pool.submit(self.fetch_with_retry, batch) for batch in self.batches(missing)]
+            for future in futures:
+                try:
+                    found.update(future.result())
+                except Exception as error:
+                    failed.append(error)
+        if len(failed) > 0:
+            raise RuntimeError(f"{len(failed)} of {len(futures)} elevation batches failed, the others are cached") from failed[0]
+        return np.array([found[key] for key in keys], dtype=float)
+
+
+def provider_from_config(opts):
+    '''
+    Elevation provider selected in the running options.
+    '''
+    if opts["elevation_provider"] == "raster":
+        return RasterElevationProvider(opts["elevation_raster_path"])
+    return HTTPElevationProvider(opts["elevation_url_template"], ElevationCache(opts["elevation_cache_path"]),
+                                 max_workers=opts["elevation_max_workers"])
+
+
+def add_node_elevations(G, provider):
+    '''
+    Sets the "elevation" attribute (meters) of every node of G from its x (lon) and y (lat).
+    '''
+    nodes = list(G.nodes)
+    lats = np.array([G.nodes[v]["y"] for v in nodes], dtype=float)
+    lons = np.array([G.nodes[v]["x"] for v in nodes], dtype=float)
+    values = np.round(provider.elevations(lats, lons), 3)
+    nx.set_node_attributes(G, dict(zip(nodes, values.tolist())), name="elevation")
+    return G
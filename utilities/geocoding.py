@@ -0,0 +1,119 @@
+# Address geocoding with a persistent cache.
+# Addresses are normalized into cache keys, answered from a SQLite cache when possible, and only the misses
+# are sent to the geocoding service, concurrently on a bounded pool and spaced out by a shared rate limit.
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utilities import sqlite_cache
+
+
+def normalize_address(address):
+    '''
+    Cache key of an address: case folded, punctuation other than separators dropped and whitespace collapsed,
+    so "123 Main St., Springfield" and "123  main st, springfield" share an entry.
+    '''
+    key = str(address).casefold()
+    key = re.sub(r"[^\w\s,#-]", "", key)
+    key = re.sub(r"\s*,\s*", ", ", key)
+    key = re.sub(r"\s+", " ", key)
+    return key.strip(" ,")
+
+
+class GeocodeCache(sqlite_cache.SQLiteCache):
+    '''
+    Persistent normalized address -> (lon, lat) cache in SQLite. Entries older than ttl_days are ignored
+    and replaced, and beyond max_entries the least recently used entries are evicted.
+    '''
+    def __init__(self, path, ttl_days=90, max_entries=10000):
+        self.ttl = ttl_days*24*60*60
+        self.max_entries = max_entries
+        super().__init__(path, "CREATE TABLE IF NOT EXISTS geocode (key TEXT PRIMARY KEY, lon REAL, lat REAL, created REAL, used REAL)")
+
+    def get_many(self, keys):
+        '''
+        :return: dict of the cached, live keys -> [lon, lat]
+        '''
+        found = {}
+        now = time.time()
+        keys = list(set(keys))
+        with self.transaction() as connection:
+            for key, lon, lat in self.select_keys(connection, "SELECT key, lon, lat FROM geocode WHERE created > ? AND ({})",
+                                                  "key = ?", keys, (now - self.ttl,)):
+                found[key] = [lon, lat]
+            connection.executemany("UPDATE geocode SET used = ? WHERE key = ?", [(now, key) for key in found])
+        return found
+
+    def put_many(self, values):
+        '''
+        :param values: dict of key -> [lon, lat]
+        '''
+        now = time.time()
+        with self.transaction() as connection:
+            connection.executemany("INSERT OR REPLACE INTO geocode VALUES (?, ?, ?, ?, ?)",
+                                   [(key, lon, lat, now, now) for key, (lon, lat) in values.items()])
+            connection.execute("DELETE FROM geocode WHERE key IN (SELECT key FROM geocode ORDER BY used DESC LIMIT -1 OFFSET ?)",
+                               (self.max_entries,))
+
+
+class RateLimiter:
+    '''
+    Spaces calls from any number of threads at least 1/rate seconds apart.
+    '''
+    def __init__(self, rate):
+        self.interval = 1.0/rate if rate else 0.0
+        self.lock = threading.Lock()
+        self.next_time = 0.0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class BatchGeocoder:
+    '''
+    Geocodes lists of addresses through the cache. Each distinct missing address is requested once.
+    :param requests_per_second: rate limit shared by all workers and calls
+    '''
+    def __init__(self, cache, max_workers=4, requests_per_second=1.5):
+        self.cache = cache
+        self.max_workers = max_workers
+        self.limiter = RateLimiter(requests_per_second)
+
+    def _fetch(self, geocode, address):
+        self.limiter.wait()
+        return geocode(address)
+
+    def geocode(self, addresses, geocode):
+        '''
+        :param geocode: callable taking an address and returning [lon, lat], with the caller's credentials;
+                        it runs on worker threads, so it must not touch streamlit state
+        :return: list of [lon, lat], one per address
+        '''
+        addresses = list(addresses)
+        keys = [normalize_address(x) for x in addresses]
+        found = self.cache.get_many(keys)
+        #the first spelling of every missing key is sent to the service
+        missing = {}
+        for key, address in zip(keys, addresses):
+            if key not in found and key not in missing:
+                missing[key] = address
+
+        failed = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {key: pool.submit(self._fetch, geocode, address) for key, address in missing.items()}
+            for key, future in futures.items():
+                try:
+                    found[key] = future.result()
+                    #store each answer right away so a failure elsewhere keeps it
+                    self.cache.put_many({key: found[key]})
+                except Exception as error:
+                    failed.append((missing[key], error))
+        if len(failed) > 0:
+            raise RuntimeError(f"could not geocode {', '.join(address for address, _ in failed)}") from failed[0][1]
+        return [found[key] for key in keys]
@@ -0,0 +1,100 @@
+# Topology simplification of the running graphs.
+# Graphs are downloaded with simplify=False, so a straight footway is a chain of many interstitial OSM nodes.
+# simplify_graph merges every such chain into one edge that carries the summed length, the elevation gained
+# and lost along the chain, its dominant (longest) tags and the full 3D geometry of the original nodes, so
+# route drawings, GPX exports and elevation profiles look exactly as before.
+import numpy as np
+import networkx as nx
+from shapely import LineString
+
+from utilities import chain_compression
+from utilities import one_all_mosp
+
+#tags that take the value covering most of the merged edge's length
+dominant_tags = ["highway", "foot", "name", "surface", "bridge", "tunnel", "lit"]
+
+
+def _dominant(values, lengths):
+    weights = {}
+    for value, length in zip(values, lengths):
+        if value is None or (isinstance(value, float) and np.isnan(value)):
+            continue
+        if isinstance(value, list):
+            value = value[0]
+        weights[value] = weights.get(value, 0) + length
+    if len(weights) == 0:
+        return None
+    return max(weights, key=weights.get)
+
+
+def simplify_graph(G, keep=()):
+    '''
+    Merges the chains of degree-2 nodes of an unsimplified OSMnx graph (see chain_compression) into single edges.
+    Merged edges hold length (sum), elevation_gain and elevation_loss (meters, from the node elevations),
+    the dominant value of each of dominant_tags, merged (number of original edges) and a 3D (x, y, elevation)
+    geometry through all original nodes. Like the route search only edges with key 0 are used.
+    :param keep: node ids that must stay in the graph
+    :return: new MultiDiGraph, its nodes are a subset of G's nodes with their attributes
+    '''
+    csr = one_all_mosp.compile_graph(G, 1, cost_attr=None)
+    compressed = chain_compression.ChainCompressedGraph(csr, keep)
+    x = np.array([G.nodes[v]["x"] for v in csr.node_ids], dtype=float)
+    y = np.array([G.nodes[v]["y"] for v in csr.node_ids], dtype=float)
+    z = np.array([G.nodes[v].get("elevation", np.nan) for v in csr.node_ids], dtype=float)
+
+    H = nx.MultiDiGraph()
+    H.graph.update(G.graph)
+    H.add_nodes_from((csr.node_ids[v], G.nodes[csr.node_ids[v]]) for v in compressed.kept)
+    for i in range(len(compressed.csr.tails)):
+        arcs = compressed.arcs[compressed.arc_indptr[i]:compressed.arc_indptr[i+1]]
+        path = np.concatenate([[csr.tails[arcs[0]]], csr.heads[arcs]])
+        ids = [csr.node_ids[v] for v in path]
+        edges = [G.edges[u, v, 0] for u, v in zip(ids, ids[1:])]
+        lengths = [float(data["length"]) for data in edges]
+        climbs = np.diff(z[path])
+
+        #untracked tags are taken from the first edge of the chain
+        attributes = dict(edges[0])
+        attributes.update(length=sum(lengths),
+                          elevation_gain=float(climbs[climbs > 0].sum()),
+                          elevation_loss=float(-climbs[climbs < 0].sum()),
+                          merged=len(arcs),
+                          geometry=LineString(np.column_stack([x[path], y[path], z[path]])))
+        for tag in dominant_tags:
+            value = _dominant([data.get(tag) for data in edges], lengths)
+            if value is None:
+                attributes.pop(tag, None)
+            else:
+                attributes[tag] = value
+        H.add_edge(ids[0], ids[-1], key=0, **attributes)
+    return H
+
+
+def _haversine(lon1, lat1, lon2, lat2):
+    #great circle distance in meters
+    lon1, lat1, lon2, lat2 = map(np.radians, (lon1, lat1, lon2, lat2))
+    a = np.sin((lat2 - lat1)/2)**2 + np.cos(lat1)*np.cos(lat2)*np.sin((lon2 - lon1)/2)**2
+    return 2*6371009*np.arcsin(np.sqrt(a))
+
+
+def route_profile(G, route):
+    '''
+    Points of a route (list of node ids) through the geometry of its edges, original nodes included.
+    A hop with no edge u -> v follows the geometry of v -> u backwards, or a straight line.
+    :return: (points, distances), a (points, 3) array of x, y, elevation and the distance in meters from the start to each point
+    '''
+    pieces = [np.array([[G.nodes[route[0]]["x"], G.nodes[route[0]]["y"], G.nodes[route[0]].get("elevation", np.nan)]])]
+    for u, v in zip(route, route[1:]):
+        if G.has_edge(u, v, 0) and "geometry" in G.edges[u, v, 0]:
+            coords = np.asarray(G.edges[u, v, 0]["geometry"].coords)
+        elif G.has_edge(v, u, 0) and "geometry" in G.edges[v, u, 0]:
+            coords = np.asarray(G.edges[v, u, 0]["geometry"].coords)[::-1]
+        else:
+            coords = np.array([[G.nodes[w]["x"], G.nodes[w]["y"], G.nodes[w].get("elevation", np.nan)] for w in (u, v)])
+        if coords.shape[1] == 2:
+            coords = np.column_stack([coords, np.full(len(coords), np.nan)])
+        #the first point of every piece is the last point of the previous one
+        pieces.append(coords[1:])
+    points = np.concatenate(pieces)
+    steps = _haversine(points[:-1, 0], points[:-1, 1], points[1:, 0], points[1:, 1])
+    return points, np.concatenate([[0], np.cumsum(steps)])
@@ -0,0 +1,81 @@
+# Loop routes on top of the one_all_mosp searches.
+# A loop of length T through its farthest point splits into two halves of about T/2: a path out from the
+# source to a turnaround node and a path from that node back to the source. Both halves are found by one
+# search from the source on the graph and one on the reversed graph, each limited to half the loop length,
+# and are joined at every turnaround node when they share no street.
+import numpy as np
+
+from utilities import one_all_mosp
+
+
+class LoopRoute:
+    '''
+    Closed route made of an outbound label (source -> node) and an inbound label of the reversed
+    graph (source -> node there, node -> source here). Mirrors the Label attributes the running page uses.
+    '''
+    def __init__(self, outbound, inbound):
+        self.outbound = outbound
+        self.inbound = inbound
+        self.node = outbound.node
+        self.costs = (np.array(outbound.costs) + np.array(inbound.costs)).tolist()
+        self.resource = outbound.resource + inbound.resource
+        #the inbound path runs from the source to node in the reversed graph
+        self.label_list = outbound.label_list + inbound.label_list[::-1][1:]
+
+    def __str__(self):
+        return str(self.label_list)
+
+
+def street_set(label):
+    #undirected edges of the label's path, so running a street back the other way counts as reuse
+    path = label.label_list
+    return {frozenset(edge) for edge in zip(path, path[1:])}
+
+
+def loop_routes(csr, source, resource, length, tolerance=.1, per_node=5, search=one_all_mosp.one_to_all_csr):
+    '''
+    Loops from source whose length is within tolerance of length, cheapest first.
+    :param csr: CSRGraph with the route costs
+    :param source: node id the loops start and end at
+    :param resource: per-arc length array of csr
+    :param length: target loop length, in the unit of resource
+    :param tolerance: accepted relative deviation from length
+    :param per_node: only the per_node cheapest (by summed costs) outbound and inbound labels of each
+                     turnaround node are paired
+    :param search: one_all_mosp.one_to_all_csr or one_all_mosp.weighted_sum_to_all
+    :return: list of LoopRoute sorted by summed costs
+    '''
+    resource = np.asarray(resource, dtype=np.float64)
+    low = (1 - tolerance)*length
+    high = (1 + tolerance)*length
+    #no half needs to be extended past half of the longest accepted loop
+    budget = high/2
+
+    reverse_csr, arcs = csr.reverse()
+    outbound = search(csr, source, resource=resource, budget=budget)
+    inbound = search(reverse_csr, source, resource=resource[arcs], budget=budget)
+
+    def cheapest(labels):
+        labels = [x for x in labels[1:] if x.resource > 0 and np.isfinite(x.costs).all()]
+        return sorted(labels, key=lambda x: sum(x.costs))[:per_node]
+
+    loops = []
+    for node, labels in outbound.items():
+        if node == source:
+            continue
+        out_labels = cheapest(labels)
+        in_labels = cheapest(inbound[node])
+        if len(out_labels) == 0 or len(in_labels) == 0:
+            continue
+        in_streets = [street_set(x) for x in in_labels]
+        for out_label in out_labels:
+            out_streets = street_set(out_label)
+            for in_label, streets in zip(in_labels, in_streets):
+                if low <= out_label.resource + in_label.resource <= high and out_streets.isdisjoint(streets):
+                    loops.append(LoopRoute(out_label, in_label))
+    if len(loops) == 0:
+        return []
+
+    #the same loop is found at each of its turnaround nodes, keep one copy of every cost vector
+    first = np.unique(np.array([x.costs for x in loops]), axis=0, return_index=True)[1]
+    return sorted((loops[i] for i in first), key=lambda x: sum(x.costs))
@@ -1,24 +1,164 @@
-import heapq
+import itertools
 import random
 import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 
 import networkx as nx
 import numpy as np
+from scipy.sparse import csgraph, csr_matrix
 
 infinity = np.inf
 
+class LabelStore:
+    '''
+    Array-backed storage for every label created during a search.
+    Label i is row i of costs; nodes[i] holds the index of its node in node_ids,
+    predecessors[i] the index of its predecessor label (-1 if it has none) and resources[i]
+    the resource (e.g. length) used along its path.
+    Paths are only rebuilt from the predecessor pointers when they are requested.
+    '''
+    def __init__(self, node_ids, num_objs, capacity=None):
+        self.node_ids = node_ids
+        self.num_objs = num_objs
+        if capacity is None:
+            #every node holds at least one label, leave room for as many non-dominated ones
+            capacity = 2*len(node_ids)
+        capacity = max(capacity, 16)
+        self.costs = np.empty((capacity, num_objs))
+        self.nodes = np.empty(capacity, dtype=np.int64)
+        self.predecessors = np.empty(capacity, dtype=np.int64)
+        self.resources = np.empty(capacity)
+        self.size = 0
+
+    def add(self, node, costs, predecessor=-1, resource=0.0):
+        '''
+        Stores a new label and returns its index.
+        :param node: index of the label's node in node_ids
+        :param costs: cost vector of the label
+        :param predecessor: index of the predecessor label, -1 if none
+        :param resource: resource used along the label's path
+        '''
+        if self.size == len(self.nodes):
+            self._grow()
+        i = self.size
+        self.costs[i] = costs
+        self.nodes[i] = node
+        self.predecessors[i] = predecessor
+        self.resources[i] = resource
+        self.size += 1
+        return i
+
+    def _grow(self):
+        #double capacity, amortized O(1) per add
+        capacity = 2*len(self.nodes)
+        self.costs = np.concatenate([self.costs, np.empty((capacity - len(self.costs), self.num_objs))])
+        self.nodes = np.concatenate([self.nodes, np.empty(capacity - len(self.nodes), dtype=np.int64)])
+        self.predecessors = np.concatenate([self.predecessors, np.empty(capacity - len(self.predecessors), dtype=np.int64)])
+        self.resources = np.concatenate([self.resources, np.empty(capacity - len(self.resources))])
+
+    @classmethod
+    def from_arrays(cls, node_ids, costs, nodes, predecessors, resources):
+        '''
+        Store holding exactly the given labels, e.g. the trimmed arrays of a store built in another process.
+        '''
+        store = object.__new__(cls)
+        store.node_ids = node_ids
+        store.num_objs = costs.shape[1]
+        store.costs = costs
+        store.nodes = nodes
+        store.predecessors = predecessors
+        store.resources = resources
+        store.size = len(nodes)
+        return store
+
+    def path(self, label):
+        '''
+        Rebuilds the path of a label by following its predecessor pointers.
+        :param label: index of the label
+        :return: list of node ids from the source to the label's node
+        '''
+        path = []
+        while label != -1:
+            path.append(self.node_ids[self.nodes[label]])
+            label = self.predecessors[label]
+        path.reverse()
+        return path
+
+    def chain(self, label):
+        '''
+        :param label: index of the label
+        :return: array of the label indices along the label's path, from the source label to label
+        '''
+        chain = []
+        while label != -1:
+            chain.append(label)
+            label = self.predecessors[label]
+        chain.reverse()
+        return np.array(chain, dtype=np.int64)
+
+    def prefix(self, label):
+        '''
+        Cumulative resource and costs along the path of a label. Every label on the path already holds
+        its totals from the source, so they are read straight out of the store arrays.
+        :param label: index of the label
+        :return: (chain, resources, costs), the label indices of the path, the resource used up to each
+                 of its nodes and the (len(chain), num_objs) matrix of costs up to each of its nodes
+        '''
+        chain = self.chain(label)
+        return chain, self.resources[chain], self.costs[chain]
+
 class Label:
-    def __init__(self, node, costs,predecessor):
-        self.node = node
-        self.costs = costs
-        self.predecessor = predecessor
-        self.label_list = []
-        if predecessor is not None:
-            for x in self.predecessor.label_list:
-                self.label_list.append(x)
-            self.label_list.append(node)
-        else:
-            self.label_list.append(node)
+    '''
+    Lightweight view of one label held in a LabelStore. The node path (label_list) is only
+    rebuilt the first time it is read.
+    '''
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+        self.node = store.node_ids[store.nodes[index]]
+        self.costs = store.costs[index].tolist()
+        self.resource = float(store.resources[index])
+        self._label_list = None
+
+    @property
+    def predecessor(self):
+        predecessor = self.store.predecessors[self.index]
+        if predecessor == -1:
+            return None
+        return Label(self.store, predecessor)
+
+    @property
+    def label_list(self):
+        if self._label_list is None:
+            self._label_list = self.store.path(self.index)
+        return self._label_list
+
+    @label_list.setter
+    def label_list(self, value):
+        self._label_list = value
+
+    def prefix(self):
+        '''
+        :return: (node ids, cumulative resources, cumulative costs) along the label's path, see LabelStore.prefix
+        '''
+        chain, resources, costs = self.store.prefix(self.index)
+        if self._label_list is None:
+            self._label_list = [self.store.node_ids[v] for v in self.store.nodes[chain]]
+        return self._label_list, resources, costs
+
+    def trim(self, limit):
+        '''
+        Cuts the label's path at the first node where the used resource exceeds limit.
+        The cut is a binary search on the cumulative resources of the path.
+        :return: Label of that node on the path (this label if the path never exceeds limit)
+        '''
+        chain, resources, _ = self.store.prefix(self.index)
+        cut = int(np.searchsorted(resources, limit, side="right"))
+        if cut >= len(chain) - 1:
+            return self
+        return Label(self.store, chain[cut])
+
     #define priority according to "lexographic min" analogous to java comparator
     def __lt__(self, other):
         c = self.costs
@@ -36,27 +176,261 @@ class Label:
         return False
 
     def dominance_check(self, other):
-        c = self.costs
-        cc = other.costs
+        return dominates(self.costs, other.costs)
 
-        counter = 0
-
-        for i in range(0,len(c)):
-            if c[i] <= cc[i]:
-                #count the better objectives
-                if c[i] < cc[i]:
-                    counter += 1
-            #if there is ever a worse, return false
-            if c[i] > cc[i]:
-                return False
+    def __str__(self):
+            return  str(self.node) + " <- " + str(self.predecessor) + str(self.label_list)
 
-        if counter >= 1:
-            return True
-        else:
+class IndexedHeap:
+    '''
+    Binary min-heap holding at most one entry per key. A position map from key to heap slot
+    makes decrease_key O(log n) instead of the O(n) remove and re-heapify of a plain heapq list.
+    Entries are [priority, key, item]; priorities only need to support <.
+    '''
+    def __init__(self):
+        self.heap = []
+        self.position = {}
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __contains__(self, key):
+        return key in self.position
+
+    def priority(self, key):
+        return self.heap[self.position[key]][0]
+
+    def push(self, key, priority, item=None):
+        '''
+        Inserts an entry for key, or lowers its priority if key is already queued with a larger one.
+        '''
+        if key in self.position:
+            self.decrease_key(key, priority, item)
+            return
+        self.heap.append([priority, key, item])
+        self.position[key] = len(self.heap) - 1
+        self._sift_up(len(self.heap) - 1)
+
+    def decrease_key(self, key, priority, item=None):
+        i = self.position[key]
+        entry = self.heap[i]
+        if not priority < entry[0]:
+            return
+        entry[0] = priority
+        entry[2] = item
+        self._sift_up(i)
+
+    def pop(self):
+        '''
+        Removes the entry with the smallest priority.
+        :return: (priority, key, item)
+        '''
+        heap = self.heap
+        last = heap.pop()
+        if len(heap) == 0:
+            del self.position[last[1]]
+            return tuple(last)
+        top = heap[0]
+        heap[0] = last
+        self.position[last[1]] = 0
+        del self.position[top[1]]
+        self._sift_down(0)
+        return tuple(top)
+
+    def _sift_up(self, i):
+        heap = self.heap
+        entry = heap[i]
+        while i > 0:
+            parent = (i - 1) >> 1
+            if not entry[0] < heap[parent][0]:
+                break
+            heap[i] = heap[parent]
+            self.position[heap[i][1]] = i
+            i = parent
+        heap[i] = entry
+        self.position[entry[1]] = i
+
+    def _sift_down(self, i):
+        heap = self.heap
+        n = len(heap)
+        entry = heap[i]
+        while True:
+            child = 2*i + 1
+            if child >= n:
+                break
+            if child + 1 < n and heap[child + 1][0] < heap[child][0]:
+                child += 1
+            if not heap[child][0] < entry[0]:
+                break
+            heap[i] = heap[child]
+            self.position[heap[i][1]] = i
+            i = child
+        heap[i] = entry
+        self.position[entry[1]] = i
+
+class ParetoSet:
+    '''
+    Permanent labels of one node. Their costs are kept in one contiguous array so a candidate,
+    or a whole block of candidates, is checked against every label with a single vectorized comparison.
+    '''
+    def __init__(self, num_objs, capacity=4):
+        self.costs = np.empty((capacity, num_objs))
+        self.labels = []
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, k):
+        return self.labels[k]
+
+    def __iter__(self):
+        return iter(self.labels)
+
+    def add(self, label, costs):
+        n = len(self.labels)
+        if n == len(self.costs):
+            self.costs = np.concatenate([self.costs, np.empty_like(self.costs)])
+        self.costs[n] = costs
+        self.labels.append(label)
+
+    def dominates(self, costs):
+        '''
+        True if any label of the set dominates or equals the cost vector. Equal labels count as
+        dominated so a path is never settled twice at the same node.
+        '''
+        front = self.costs[:len(self.labels)]
+        return bool((front <= costs).all(axis=1).any())
+
+    def filter(self, candidates):
+        '''
+        Batch version of dominates.
+        :param candidates: (m, num_objs) array of cost vectors
+        :return: boolean mask, True for the candidates no label of the set dominates or equals
+        '''
+        front = self.costs[:len(self.labels), None, :]
+        candidates = np.asarray(candidates)[None, :, :]
+        return ~(front <= candidates).all(axis=2).any(axis=0)
+
+def pareto_mask(costs):
+    '''
+    Marks the rows of a cost matrix that no other row dominates.
+    :param costs: (m, num_objs) array of cost vectors
+    :return: boolean mask of the non-dominated rows
+    '''
+    costs = np.asarray(costs)
+    dominated = np.all(costs[:, None, :] <= costs[None, :, :], axis=2) & np.any(costs[:, None, :] < costs[None, :, :], axis=2)
+    return ~np.any(dominated, axis=0)
+
+def dominates(c, cc):
+    '''
+    True if cost vector c is no worse than cc in every objective and better in at least one.
+    '''
+    counter = 0
+
+    for i in range(0,len(c)):
+        if c[i] <= cc[i]:
+            #count the better objectives
+            if c[i] < cc[i]:
+                counter += 1
+        #if there is ever a worse, return false
+        if c[i] > cc[i]:
             return False
 
-    def __str__(self):
-            return  str(self.node) + " <- " + str(self.predecessor) + str(self.label_list)
+    if counter >= 1:
+        return True
+    else:
+        return False
+
+class CSRGraph:
+    '''
+    Integer indexed snapshot of a graph for the MOSP search.
+    Node i is node_ids[i]. Arc a runs from tails[a] to heads[a] with cost vector costs[a]; arcs are
+    sorted by tail, so the arcs leaving node i are out_indptr[i]:out_indptr[i+1]. The arcs entering
+    node i are in_arcs[in_indptr[i]:in_indptr[i+1]].
+    '''
+    def __init__(self, node_ids, tails, heads, costs):
+        self.node_ids = node_ids
+        self.node_index = {v: i for i, v in enumerate(node_ids)}
+        n = len(node_ids)
+
+        order = np.argsort(tails, kind="stable")
+        self.tails = np.asarray(tails, dtype=np.int64)[order]
+        self.heads = np.asarray(heads, dtype=np.int64)[order]
+        self.costs = np.asarray(costs, dtype=np.float64).reshape(len(order), -1)[order]
+        self.out_indptr = np.concatenate([[0], np.cumsum(np.bincount(self.tails, minlength=n))])
+
+        self.in_arcs = np.argsort(self.heads, kind="stable")
+        self.in_indptr = np.concatenate([[0], np.cumsum(np.bincount(self.heads, minlength=n))])
+
+    #arrays that fully describe the snapshot besides node_ids
+    array_names = ("tails", "heads", "costs", "out_indptr", "in_arcs", "in_indptr")
+
+    @classmethod
+    def from_arrays(cls, node_ids, arrays):
+        '''
+        Rebuilds a snapshot around existing arrays (e.g. views of shared memory) without copying them.
+        :param arrays: dict with an array for each name in array_names
+        '''
+        csr = object.__new__(cls)
+        csr.node_ids = node_ids
+        csr.node_index = {v: i for i, v in enumerate(node_ids)}
+        for name in cls.array_names:
+            setattr(csr, name, arrays[name])
+        return csr
+
+    @property
+    def num_objs(self):
+        return self.costs.shape[1]
+
+    def arcs(self):
+        '''
+        Yields (u,v) node id pairs in arc order, to line up edge attributes with rows of costs.
+        '''
+        for u, v in zip(self.tails.tolist(), self.heads.tolist()):
+            yield self.node_ids[u], self.node_ids[v]
+
+    def with_costs(self, costs):
+        '''
+        Copy of the snapshot sharing its topology arrays but with a new (arcs, num_objs) cost matrix.
+        '''
+        copy = object.__new__(CSRGraph)
+        copy.__dict__.update(self.__dict__)
+        copy.costs = np.asarray(costs, dtype=np.float64).reshape(len(self.tails), -1)
+        return copy
+
+    def reverse(self):
+        '''
+        Snapshot with every arc turned around, for searches towards a node instead of away from it.
+        :return: (reversed snapshot, arcs) where arc a of the reversed snapshot is arc arcs[a] of this one,
+                 so a per-arc array x of this snapshot lines up with the reversed one as x[arcs]
+        '''
+        #the reversed arcs are sorted by their new tail, which is exactly the order of in_arcs
+        return CSRGraph(self.node_ids, self.heads, self.tails, self.costs), self.in_arcs
+
+def compile_graph(G, num_objs, cost_attr="costs"):
+    '''
+    Converts a networkx graph into a CSRGraph. For multigraphs only the arc with key 0 between
+    two nodes is kept, as the search has always done.
+    :param cost_attr: edge attribute holding the cost list, or None to leave all costs at zero
+    '''
+    node_ids = list(G.nodes)
+    node_index = {v: i for i, v in enumerate(node_ids)}
+    if G.is_multigraph():
+        edges = ((u, v, data) for u, v, k, data in G.edges(keys=True, data=True) if k == 0)
+    else:
+        edges = G.edges(data=True)
+
+    tails = []
+    heads = []
+    costs = []
+    for u, v, data in edges:
+        tails.append(node_index[u])
+        heads.append(node_index[v])
+        if cost_attr is not None:
+            costs.append(data[cost_attr])
+    if cost_attr is None:
+        costs = np.zeros((len(tails), num_objs))
+    return CSRGraph(node_ids, tails, heads, np.asarray(costs, dtype=np.float64).reshape(len(tails), num_objs))
 
 def scale_edge_costs(G, num_objs):
     maxes = num_objs*[0]
@@ -78,144 +452,374 @@ def scale_edge_costs(G, num_objs):
             edge["costs"][i] = scale_value(edge["costs"][i],mins[i],maxes[i])
 
     return G
-def nextCandidateLabel(v,lastProcessedLabel,sigma, L, G,num_objs):
-    l_v = Label(v, num_objs*[infinity],None)
-
-    for u in sigma:
-        for k in range(lastProcessedLabel[(u,v,0)],len(L[u])):
-                l_u = L[u][k]
-                l_new = Label(v, [label_costs + new_costs for label_costs, new_costs in zip(l_u.costs,G.edges[(u,v,0)]["costs"])], l_u)
-
-                #print(l_new.costs)
-                lastProcessedLabel[(u,v)] = k
-
-                dominance_result = False
-
-                for label in L[v]:
-                    if label.dominance_check(l_new):
-                        dominance_result = True
-                        break
-                if dominance_result is False:
-                    if l_new.__lt__(l_v):
-                        l_v = l_new
-                        break
-
-    if l_v.costs is not len(l_v.costs) * [infinity]:
+def nextCandidateLabel(v,lastProcessedLabel, L, csr, store, stats, pruning):
+    '''
+    Best (lexicographic min) label for v that extends a permanent label of a predecessor and is not
+    dominated by L[v]. lastProcessedLabel[a] is the first label at the tail of arc a not yet known to
+    give a dominated extension over a, so every scan resumes where the previous one stopped.
+    Extensions ruled out by pruning count as dominated.
+    '''
+    l_v_costs = store.num_objs*[infinity]
+    l_v_predecessor = -1
+
+    for a in csr.in_arcs[csr.in_indptr[v]:csr.in_indptr[v+1]].tolist():
+        u = csr.tails[a]
+        start = lastProcessedLabel[a]
+        end = len(L[u])
+        if start >= end:
+            continue
+        #check the remaining extensions over a against L[v] in doubling blocks, up to the first non-dominated one
+        block = 1
+        while start < end:
+            stop = min(start + block, end)
+            candidates = L[u].costs[start:stop] + csr.costs[a]
+            not_dominated = L[v].filter(candidates)
+            if pruning["budget"] < infinity:
+                not_dominated &= store.resources[L[u].labels[start:stop]] < pruning["budget"]
+            stats["labels_created"] += len(candidates)
+            stats["dominance_checks"] += len(candidates)
+            k = np.argmax(not_dominated)
+            if not_dominated[k]:
+                break
+            start += len(candidates)
+            block *= 2
+
+        #labels before the first non-dominated extension are never looked at again over this arc,
+        #the extension itself stays the resume point until L[v] dominates it
+        if start >= end:
+            lastProcessedLabel[a] = end
+            continue
+        lastProcessedLabel[a] = start + k
+        l_new_costs = candidates[k].tolist()
+        if l_new_costs < l_v_costs:
+            l_v_costs = l_new_costs
+            l_v_predecessor = L[u][start + k]
+            l_v_arc = a
+
+    if l_v_predecessor == -1:
         return None
-    return l_v
-
-def propogate(l_v, w, H,H_vector, L, G):
-    l_new = Label(w,[label_costs + new_costs for label_costs, new_costs in zip(l_v.costs,G.edges[(l_v.node,w,0)]["costs"])], l_v)
-
-    dominance_result = False
-
-    for label in L[w]:
-        if label.dominance_check(l_new):
-            dominance_result = True
-            break
-
-    if dominance_result is False:
-        existing_labels = False
-        if w in H_vector.keys():
-            existing_labels = True
-
-        if existing_labels is False:
-            heapq.heappush(H, l_new)
-            H_vector[w] = l_new
-        elif l_new.__lt__(H_vector[w]):
-            H.remove(H_vector[w])
-            heapq.heapify(H)
-            heapq.heappush(H, l_new)
-            H_vector[w] = l_new
-    return H, H_vector
-
-def one_to_all(G,source,num_objs):
-
-    #G = scale_edge_costs(G, num_objs)
-    H = []
-    heapq.heapify(H)
-
-    H_vector = {}
-
-    L = {}
-
-    for v,data in G.nodes.data():
-        if v == source:
-            L[v] = [Label(v,num_objs*[0],None)]
-        else:
-            L[v] = [Label(v,num_objs*[infinity],None)]
-
-    last_processed_label = {}
-    for a in G.edges:
-        last_processed_label[a] = 0
-
-    l_ll = Label(source,num_objs*[0],None)
-    heapq.heappush(H, l_ll)
-    H_vector[source] = l_ll
+    return store.add(v, l_v_costs, l_v_predecessor, store.resources[l_v_predecessor] + pruning["resource"][l_v_arc])
+
+def propogate(l_v, a, H, L, csr, store, stats, pruning):
+    w = csr.heads[a]
+    l_new_costs = store.costs[l_v] + csr.costs[a]
+    stats["labels_created"] += 1
+    stats["dominance_checks"] += 1
+
+    if not L[w].dominates(l_new_costs):
+        #heap priorities are (cost tuple, label index), so the heap orders by lexicographic min
+        #the label is only stored once it enters the heap, its index is the store's next slot
+        priority = (tuple(l_new_costs.tolist()), store.size)
+        if w not in H:
+            l_new = store.add(w, l_new_costs, l_v, store.resources[l_v] + pruning["resource"][a])
+            H.push(w, priority, l_new)
+            stats["heap_ops"] += 1
+        elif priority[0] < H.priority(w)[0]:
+            l_new = store.add(w, l_new_costs, l_v, store.resources[l_v] + pruning["resource"][a])
+            H.decrease_key(w, priority, l_new)
+            stats["heap_ops"] += 1
+    return H
+
+def mosp_search(csr, source, stats=None, resource=None, budget=infinity):
+    '''
+    Multiobjective Dijkstra on a CSRGraph, working only on its integer arrays.
+    :param source: index of the source node in csr.node_ids
+    :param stats: optional dict, filled with the search counters labels_created, labels_stored,
+                  labels_settled, dominance_checks and heap_ops
+    :param resource: optional per-arc array (e.g. length) accumulated along each label's path
+    :param budget: labels whose resource has reached the budget are settled but not extended further.
+                   The resource is not an objective, so this is a heuristic radius cut rather than an
+                   exact resource-constrained search.
+    :return: (store, L) where L[i] is the ParetoSet of node i, an initial placeholder followed by its Pareto optimal labels
+    '''
+    num_objs = csr.num_objs
+    n = len(csr.node_ids)
+    store = LabelStore(csr.node_ids, num_objs)
+    counters = dict(labels_created=0, labels_stored=0, labels_settled=0, dominance_checks=0, heap_ops=0)
+
+    if resource is None:
+        resource = np.zeros(len(csr.tails))
+    pruning = dict(resource=np.asarray(resource, dtype=np.float64), budget=budget)
+
+    H = IndexedHeap()
+
+    #permanent labels of each node
+    L = [ParetoSet(num_objs) for v in range(n)]
+
+    for v in range(n):
+        costs = num_objs*[0] if v == source else num_objs*[infinity]
+        L[v].add(store.add(v,costs), costs)
+
+    last_processed_label = np.zeros(len(csr.tails), dtype=np.int64)
+
+    l_ll = store.add(source,num_objs*[0])
+    H.push(source, (tuple(num_objs*[0]), l_ll), l_ll)
+    counters["heap_ops"] += 1
 
     #line 7
-    count = 0
     while len(H) > 0:
-        l_v_star = heapq.heappop(H)
-        #del H_vector[l_v_star.node]
-        L[l_v_star.node].append(l_v_star)
-
-        u = []
-        for uu, v in G.in_edges(l_v_star.node):
-            u.append(uu)
-
-        #running nextCandidate only for source
-        #if l_v_star.node is source:
-        #    l_v_new = nextCandidateLabel(l_v_star.node,last_processed_label,u,L, G,num_objs)
-        #    if l_v_new is not None:
-        #        heapq.heappush(H,l_v_new)
+        v_star, l_v_star = H.pop()[1:]
+        counters["heap_ops"] += 1
+        counters["labels_settled"] += 1
+        L[v_star].add(l_v_star, store.costs[l_v_star])
 
         #running nextCandidate as described in MOSP paper
-        l_v_new = nextCandidateLabel(l_v_star.node,last_processed_label,u,L, G,num_objs)
+        l_v_new = nextCandidateLabel(v_star,last_processed_label,L,csr,store,counters,pruning)
         if l_v_new is not None:
-            heapq.heappush(H,l_v_new)
-            H_vector[l_v_new.node] = l_v_new
-
-        sigma_plus = []
-        for u, v in G.out_edges(l_v_star.node):
-            sigma_plus.append(v)
-
-        for w in sigma_plus:
-            H, H_vector = propogate(l_v_star,w,H,H_vector, L,G)
-
-        #print(H_vector)
-    #print("iteration")
-        #print(count)
-        #count = count + 1
-        #print(len(H))
-        #for x in L.values():
-         #   print(x[-1])
-        #    for xx in x:
-         #       print(xx)
-
-    return L
+            H.push(v_star, (tuple(store.costs[l_v_new].tolist()), l_v_new), l_v_new)
+            counters["heap_ops"] += 1
+
+        if store.resources[l_v_star] >= budget:
+            continue
+        for a in range(csr.out_indptr[v_star], csr.out_indptr[v_star+1]):
+            H = propogate(l_v_star,a,H,L,csr,store,counters,pruning)
+
+    counters["labels_stored"] = store.size
+    if stats is not None:
+        stats.update(counters)
+    return store, L
+
+def one_to_all_csr(csr, source, stats=None, resource=None, budget=infinity):
+    '''
+    Runs mosp_search from the node with id source.
+    :return: dict of node -> list of Labels, the Pareto optimal labels of the node after an initial placeholder
+    '''
+    store, L = mosp_search(csr, csr.node_index[source], stats, resource, budget)
+    #paths are only materialized when a returned label's label_list is read
+    return {csr.node_ids[v]: [Label(store, label) for label in labels] for v, labels in enumerate(L)}
+
+def one_to_all(G,source,num_objs, stats=None):
+    '''
+    Multiobjective Dijkstra from source to every node of G. Arcs need a "costs" list with num_objs entries.
+    G is compiled into a CSRGraph first; build the snapshot once with compile_graph and call
+    one_to_all_csr directly when solving repeatedly on the same graph.
+    :param stats: optional dict, see mosp_search
+    :return: dict of node -> list of Labels, the Pareto optimal labels of the node after an initial placeholder
+    '''
+    #G = scale_edge_costs(G, num_objs)
+    return one_to_all_csr(compile_graph(G, num_objs), source, stats)
+
+def weight_vectors(num_objs, divisions=2):
+    '''
+    Weight vectors of the simplex lattice with the given number of divisions, plus its centroid.
+    For 3 objectives and 2 divisions these are the 3 unit vectors, the 3 pairwise midpoints and the centroid.
+    :return: (weights, num_objs) array, every row sums to 1
+    '''
+    weights = [w for w in itertools.product(range(divisions + 1), repeat=num_objs) if sum(w) == divisions]
+    weights = np.array(weights, dtype=float)/divisions
+    return np.unique(np.vstack([weights, np.full((1, num_objs), 1.0/num_objs)]), axis=0)
+
+class ScalarGraph:
+    '''
+    scipy.sparse.csgraph matrix of a CSRGraph under one per-arc weight, for single-objective shortest path trees.
+    csr_matrix would sum parallel arcs, so only the cheapest arc of each node pair is kept, and csgraph ignores
+    zero weight entries, so every weight is raised to at least min_weight.
+    :param weights: per-arc array
+    '''
+    def __init__(self, csr, weights, min_weight=1e-12):
+        n = len(csr.node_ids)
+        self.n = n
+        weights = np.maximum(np.asarray(weights, dtype=np.float64), min_weight)
+        self._pair = csr.tails.astype(np.int64)*n + csr.heads
+        order = np.lexsort((weights, self._pair))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = self._pair[order][1:] != self._pair[order][:-1]
+        #arcs[k] is the arc of the k-th entry, sorted by node pair
+        self.arcs = order[first]
+        self.matrix = csr_matrix((weights[self.arcs], (csr.tails[self.arcs], csr.heads[self.arcs])), shape=(n, n))
+
+    def trees(self, indices, values):
+        '''
+        Shortest path trees from the given nodes, with per-arc values summed along the tree paths.
+        :param indices: array of source node indices
+        :param values: (arcs, k) per-arc array
+        :return: (distances, parents, path_values) of shapes (sources, n), (sources, n) and (sources, n, k);
+                 parents are -1 at the sources and at unreached nodes, whose path_values are 0
+        '''
+        indices = np.atleast_1d(indices)
+        values = np.asarray(values, dtype=np.float64).reshape(len(self._pair), -1)
+        distances, predecessors = csgraph.dijkstra(self.matrix, indices=indices, return_predecessors=True)
+        parents = np.where(predecessors >= 0, predecessors, -1).astype(np.int64)
+        rows, nodes = np.nonzero(parents >= 0)
+        tree_arcs = self.arcs[np.searchsorted(self._pair[self.arcs], parents[rows, nodes]*self.n + nodes)]
+        path_values = np.zeros(parents.shape + (values.shape[1],))
+        path_values[rows, nodes] = values[tree_arcs]
+
+        #pointer jumping, each round doubles the summed path length
+        jump = parents.copy()
+        while True:
+            rows, nodes = np.nonzero(jump >= 0)
+            if len(rows) == 0:
+                break
+            up = jump[rows, nodes]
+            path_values[rows, nodes] += path_values[rows, up]
+            jump[rows, nodes] = jump[rows, up]
+        return distances, parents, path_values
+
+def weighted_sum_search(csr, source, weights=None, stats=None, resource=None, budget=infinity):
+    '''
+    Approximation of mosp_search by one single-objective Dijkstra (scipy.sparse.csgraph) per weight vector
+    on the weighted sum of the objectives. Each objective is divided by its mean arc cost first so the weights
+    are comparable across objectives. Only supported points of the fronts can be found, at most one per
+    weight vector and node, and labels dominated by another weight vector's label at the same node are dropped.
+    :param source: index of the source node in csr.node_ids
+    :param weights: (weights, num_objs) array, weight_vectors(num_objs) if None
+    :param stats: optional dict, filled with dijkstra_runs, labels_stored and labels_settled
+    :param resource: optional per-arc array (e.g. length) accumulated along each label's path
+    :param budget: labels are only kept if their predecessor's resource is below the budget, as in mosp_search
+    :return: (store, L) where L[i] is the list of label indices of node i, an initial placeholder followed by its labels
+    '''
+    num_objs = csr.num_objs
+    n = len(csr.node_ids)
+    if weights is None:
+        weights = weight_vectors(num_objs)
+    weights = np.atleast_2d(np.asarray(weights, dtype=float))
+    if resource is None:
+        resource = np.zeros(len(csr.tails))
+    resource = np.asarray(resource, dtype=np.float64)
+    costs = np.asarray(csr.costs, dtype=np.float64)
+    scale = costs.mean(axis=0) if len(costs) > 0 else np.ones(num_objs)
+    scale[~(np.isfinite(scale) & (scale > 0))] = 1
+
+    #label block 0 holds the placeholders, block b the shortest path tree of weight vector b-1
+    blocks = len(weights) + 1
+    label_costs = np.full((blocks*n, num_objs), infinity)
+    label_costs[source] = 0
+    label_nodes = np.tile(np.arange(n, dtype=np.int64), blocks)
+    label_predecessors = np.full(blocks*n, -1, dtype=np.int64)
+    label_resources = np.zeros(blocks*n)
+
+    #costs and resource are accumulated along each tree together
+    values = np.column_stack([costs, resource])
+    for b, w in enumerate(weights, start=1):
+        #a small weight on every objective breaks ties towards Pareto optimal paths when w has zeros
+        graph = ScalarGraph(csr, (costs/scale) @ (w + 1e-4))
+        _, parents, path_values = graph.trees([source], values)
+        parent = parents[0]
+        tree = np.flatnonzero(parent >= 0)
+        path_costs = path_values[0, :, :num_objs]
+        path_resources = path_values[0, :, num_objs]
+
+        offset = b*n
+        reached = np.append(tree, source)
+        #a label past the budget is only kept if it was extended from a label within the budget
+        within = (parent[reached] == -1) | (path_resources[np.maximum(parent[reached], 0)] < budget)
+        reached = reached[within]
+        label_costs[offset + reached] = path_costs[reached]
+        label_resources[offset + reached] = path_resources[reached]
+        label_predecessors[offset + tree] = offset + parent[tree]
+
+    #keep the labels of each node that are neither dominated by nor equal to another weight vector's label
+    front = label_costs[n:].reshape(len(weights), n, num_objs)
+    keep = np.isfinite(front).all(axis=2)
+    for i in range(len(weights)):
+        for j in range(len(weights)):
+            if i == j:
+                continue
+            no_worse = (front[j] <= front[i]).all(axis=1)
+            better = (front[j] < front[i]).any(axis=1)
+            keep[i] &= ~(no_worse & (better | (j < i)))
+
+    L = [[v] for v in range(n)]
+    for i in range(len(weights)):
+        for v in np.flatnonzero(keep[i]):
+            L[v].append((i + 1)*n + v)
+
+    store = LabelStore.from_arrays(csr.node_ids, label_costs, label_nodes, label_predecessors, label_resources)
+    if stats is not None:
+        stats.update(dijkstra_runs=len(weights), labels_stored=store.size, labels_settled=int(keep.sum()))
+    return store, L
+
+def weighted_sum_to_all(csr, source, weights=None, stats=None, resource=None, budget=infinity):
+    '''
+    Runs weighted_sum_search from the node with id source.
+    :return: dict of node -> list of Labels like one_to_all_csr, a placeholder followed by the labels found
+    '''
+    store, L = weighted_sum_search(csr, csr.node_index[source], weights, stats, resource, budget)
+    return {csr.node_ids[v]: [Label(store, label) for label in labels] for v, labels in enumerate(L)}
+
+#graph snapshot and pruning options of a many_to_all worker process, attached to the parent's shared memory
+_shared_graph = None
+_shared_resource = None
+_shared_budget = infinity
+_shared_blocks = []
+
+def _attach_shared_graph(n, spec, budget):
+    global _shared_graph, _shared_resource, _shared_budget
+    arrays = {}
+    for name, (block_name, shape, dtype) in spec.items():
+        #workers share the parent's resource tracker, the parent unlinks the blocks when the pool is done
+        block = shared_memory.SharedMemory(name=block_name)
+        _shared_blocks.append(block)
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+    _shared_resource = arrays.pop("resource", None)
+    _shared_budget = budget
+    _shared_graph = CSRGraph.from_arrays(range(n), arrays)
+
+def _search_shared_graph(source):
+    stats = {}
+    store, L = mosp_search(_shared_graph, source, stats, _shared_resource, _shared_budget)
+    size = store.size
+    labels = [labels.labels for labels in L]
+    front_indptr = np.concatenate([[0], np.cumsum([len(x) for x in labels])])
+    return (store.costs[:size].copy(), store.nodes[:size].copy(), store.predecessors[:size].copy(),
+            store.resources[:size].copy(), np.concatenate(labels), front_indptr, stats)
+
+def many_to_all(csr, sources, stats=None, resource=None, budget=infinity, max_workers=None):
+    '''
+    Runs one_to_all_csr from every node id in sources concurrently in a process pool. The snapshot's
+    arrays and the resource are copied once into shared memory and every worker maps them read only, so
+    a task only sends its source index.
+    :param stats: optional dict, filled with source -> search counters
+    :param resource, budget: pruning options, see mosp_search
+    :param max_workers: process pool size, defaults to the number of cores
+    :return: dict of source -> (dict of node -> list of Labels), as returned by one_to_all_csr
+    '''
+    blocks = []
+    spec = {}
+    arrays = {name: getattr(csr, name) for name in CSRGraph.array_names}
+    if resource is not None:
+        arrays["resource"] = np.asarray(resource, dtype=np.float64)
+    try:
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            blocks.append(block)
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+            spec[name] = (block.name, array.shape, array.dtype.str)
+
+        results = {}
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_attach_shared_graph, initargs=(len(csr.node_ids), spec, budget)) as pool:
+            futures = {source: pool.submit(_search_shared_graph, csr.node_index[source]) for source in sources}
+            for source, future in futures.items():
+                costs, nodes, predecessors, resources, front_labels, front_indptr, source_stats = future.result()
+                store = LabelStore.from_arrays(csr.node_ids, costs, nodes, predecessors, resources)
+                results[source] = {csr.node_ids[v]: [Label(store, label) for label in front_labels[front_indptr[v]:front_indptr[v+1]].tolist()]
+                                   for v in range(len(csr.node_ids))}
+                if stats is not None:
+                    stats[source] = source_stats
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+    return results
+
+def example_instances():
+    '''
+    The small instances checked by main(), also used by the benchmarks.
+    :return: list of (description, graph, source, num_objs)
+    '''
+    instances = []
 
-def main():
     G = nx.DiGraph()
-
-    print("Source is 1. Small case where 1-2-3 is still preferred even though distance is large, because elevation is an order of maginude larger. ")
     G.add_edge(1,2,costs=[1,1])
     G.add_edge(2,1,costs = [1,1])
     G.add_edge(1,3,costs=[1,1000000000])
     G.add_edge(3,1,costs=[1,1])
     G.add_edge(2,3,costs=[100000,100000])
     G.add_edge(3,2,costs=[1,1])
+    instances.append(("Source is 1. Small case where 1-2-3 is still preferred even though distance is large, because elevation is an order of maginude larger. ",G,1,2))
 
-    #run multiple objective with source node 1
-    result = one_to_all(G,1,2)
-
-
-    print("MOSP solution")
-    for x in result.values():
-        print(str(x[-1].label_list) + ", costs: " + str(x[-1].costs))
-
-
-    print("Source is 1. Generated, complete graph case, single objective")
     # Generate a complete graph w/ 10 nodes and add random edges
     complete_graph = nx.complete_graph(10)
     G = nx.DiGraph()
@@ -226,36 +830,15 @@ def main():
     for u, v in complete_graph.edges:
             G.add_edge(u, v, costs=[0,random.randint(1,10)])
             G.add_edge(v, u,costs=[ 0,random.randint(1,10)])
+    instances.append(("Source is 1. Generated, complete graph case, single objective",G,1,2))
 
-    #run multipl objective with source node 1
-    result = one_to_all(G,1,2)
-
-
-    print("MOSP Solution")
-    for x in result.values():
-        print(str(x[-1].label_list) + ", costs: " + str(x[-1].costs))
-
-    print("NextworkX solution")
-    gen = nx.single_source_all_shortest_paths(G,source = 1,weight='length')
-    for x in gen:
-        print(x)
-
-    print("Source is 1. Generated, half of arcs removed, single objective, alternate optimal")
+    G = G.copy()
     for u, v in complete_graph.edges:
         if random.random() > 0.5:
             G.remove_edge(u,v)
-
-            #run multipl objective with source node 1
-    result = one_to_all(G,1,2)
-
-
-    print("MOSP solution")
-    for x in result.values():
-        print(str(x[-1].label_list) + ", costs: " + str(x[-1].costs))
+    instances.append(("Source is 1. Generated, half of arcs removed, single objective, alternate optimal",G,1,2))
 
     #paper example 1
-    #cg = nx.complete_graph(range(0,5))
-
     G = nx.DiGraph()
 
     G.add_edge(0,1,costs=[1,0,2])
@@ -267,13 +850,27 @@ def main():
     G.add_edge(3,4,costs=[2,1,0])
     G.add_edge(3,5,costs=[5,5,5])
     G.add_edge(4,5,costs=[2,2,0])
+    instances.append(("MOSP solution paper example 1 ",G,0,3))
+
+    return instances
+
+def main():
+    for description, G, source, num_objs in example_instances():
+        print(description)
+
+        start = time.time_ns()
+        result = one_to_all(G,source,num_objs)
+        print(time.time_ns() - start)
+
+        print("MOSP solution")
+        for x in result.values():
+            print(str(x[-1].label_list) + ", costs: " + str(x[-1].costs))
 
-    start = time.time_ns()
-    result = one_to_all(G,0,3)
-    print(time.time_ns() - start)
-    print("MOSP solution paper example 1 ")
-    for x in result.values():
-       print(str(x[-1].label_list) + ", costs: " + str(x[-1].costs))
+        if num_objs == 2 and "Generated" in description:
+            print("NextworkX solution")
+            gen = nx.single_source_all_shortest_paths(G,source = source,weight='length')
+            for x in gen:
+                print(x)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
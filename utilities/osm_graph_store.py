@@ -0,0 +1,131 @@
+# Persistent on-disk store of downloaded OSM graphs.
+# Graphs are saved as GraphML next to a small JSON index of their bounding boxes. A request for an area
+# inside an already stored bounding box is answered by clipping the stored graph instead of querying Overpass.
+import contextlib
+import functools
+import hashlib
+import json
+import os
+import time
+import uuid
+
+import osmnx
+from shapely import STRtree, box
+
+
+class GraphStore:
+    '''
+    Stored graphs are keyed by bounding box (north, south, east, west) and by the list of custom
+    filters they were downloaded with. Entries older than max_age_days are ignored so OSM edits
+    are picked up eventually, and are deleted the next time a graph is saved.
+    '''
+    def __init__(self, directory, max_age_days=30, lock_timeout=60):
+        self.directory = directory
+        self.max_age = max_age_days*24*60*60
+        self.lock_timeout = lock_timeout
+        self.index_path = os.path.join(directory, "index.json")
+        self.lock_path = os.path.join(directory, "index.lock")
+        os.makedirs(directory, exist_ok=True)
+
+    def _entries(self):
+        if not os.path.exists(self.index_path):
+            return []
+        with open(self.index_path) as f:
+            return json.load(f)
+
+    def _write_entries(self, entries):
+        #write to a temporary file first so concurrent sessions never read a half written index
+        tmp_path = f"{self.index_path}.{uuid.uuid4().hex}"
+        with open(tmp_path, "w") as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, self.index_path)
+
+    @contextlib.contextmanager
+    def _index_lock(self):
+        #a lock file created exclusively serializes index updates across sessions and processes
+        while True:
+            try:
+                fd = os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                #a lock left behind by a crashed process is taken over once it is older than the timeout
+                try:
+                    if time.time() - os.path.getmtime(self.lock_path) > self.lock_timeout:
+                        os.remove(self.lock_path)
+                        continue
+                except OSError:
+                    continue
+                time.sleep(.05)
+        try:
+            yield
+        finally:
+            os.close(fd)
+            os.remove(self.lock_path)
+
+    def _remove_file(self, file):
+        try:
+            os.remove(os.path.join(self.directory, file))
+        except OSError:
+            #already gone, or still open elsewhere, it is retried with the next prune
+            return False
+        return True
+
+    @staticmethod
+    def filters_key(filters):
+        return hashlib.sha1(json.dumps(list(filters)).encode()).hexdigest()
+
+    def find(self, bbox, filters):
+        '''
+        Smallest live stored entry whose bounding box contains bbox, or None.
+        :param bbox: (north, south, east, west)
+        '''
+        key = self.filters_key(filters)
+        now = time.time()
+        entries = [x for x in self._entries() if x["filters"] == key and now - x["created"] < self.max_age
+                   and os.path.exists(os.path.join(self.directory, x["file"]))]
+        if len(entries) == 0:
+            return None
+
+        north, south, east, west = bbox
+        tree = STRtree([box(x["west"], x["south"], x["east"], x["north"]) for x in entries])
+        hits = tree.query(box(west, south, east, north), predicate="within")
+        if len(hits) == 0:
+            return None
+        return min((entries[i] for i in hits), key=lambda x: (x["north"] - x["south"])*(x["east"] - x["west"]))
+
+    def get(self, bbox, filters):
+        '''
+        Graph for bbox clipped from a stored graph, or None if no stored graph covers it.
+        '''
+        entry = self.find(bbox, filters)
+        if entry is None:
+            return None
+        path = os.path.join(self.directory, entry["file"])
+        north, south, east, west = bbox
+        return osmnx.truncate.truncate_graph_bbox(_load_graph(path, os.path.getmtime(path)), north, south, east, west,
+                                                  truncate_by_edge=False, retain_all=False)
+
+    def put(self, bbox, filters, G):
+        '''
+        Saves G as the graph of bbox downloaded with filters.
+        '''
+        north, south, east, west = bbox
+        file = f"{uuid.uuid4().hex}.graphml"
+        osmnx.save_graphml(G, os.path.join(self.directory, file))
+
+        with self._index_lock():
+            now = time.time()
+            entries = []
+            for x in self._entries():
+                #expired graphs are deleted, an entry whose file cannot be deleted yet stays listed until it can
+                if now - x["created"] < self.max_age or not self._remove_file(x["file"]):
+                    entries.append(x)
+            entries.append(dict(file=file, north=north, south=south, east=east, west=west,
+                                filters=self.filters_key(filters), created=now))
+            self._write_entries(entries)
+
+
+@functools.lru_cache(maxsize=4)
+def _load_graph(path, mtime):
+    #mtime is part of the cache key so a rewritten file is loaded again
+    return osmnx.load_graphml(path)
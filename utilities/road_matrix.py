@@ -0,0 +1,119 @@
+# Offline travel matrices on a local OSM road graph.
+# The road network around the stops is downloaded with osmnx once (and kept in the GraphStore like the running
+# graphs), compiled into a CSR graph, and every many-to-many matrix is answered by one multi-source Dijkstra
+# (scipy.sparse.csgraph) on travel time. Distances are summed along the same fastest paths, as openrouteservice does.
+import numpy as np
+import osmnx
+from scipy.sparse import csgraph
+
+from utilities import one_all_mosp
+
+meters_per_mile = 1609.34
+
+
+class LocalRoadMatrix:
+    '''
+    Many-to-many fastest path distances (miles) and durations (seconds) on one road graph.
+    :param G: osmnx MultiDiGraph, edges need length (meters) and, if speed_kph is None, travel_time (seconds)
+    :param speed_kph: constant travel speed for walking and cycling profiles, None to use the travel_time of the edges
+    :param max_snap_distance: locations farther than this (meters) from every graph node are rejected
+    '''
+    def __init__(self, G, speed_kph=None, max_snap_distance=1000):
+        self.G = G
+        self.max_snap_distance = max_snap_distance
+        node_ids = list(G.nodes)
+        node_index = {v: i for i, v in enumerate(node_ids)}
+        tails = []
+        heads = []
+        costs = []
+        for u, v, data in G.edges(data=True):
+            length = float(data["length"])
+            duration = length/(speed_kph/3.6) if speed_kph is not None else float(data["travel_time"])
+            tails.append(node_index[u])
+            heads.append(node_index[v])
+            costs.append((length, duration))
+        #arc costs are (length, duration)
+        self.csr = one_all_mosp.CSRGraph(node_ids, tails, heads, np.asarray(costs, dtype=np.float64).reshape(-1, 2))
+        #fastest paths, of parallel arcs only the fastest is kept
+        self.graph = one_all_mosp.ScalarGraph(self.csr, self.csr.costs[:, 1], min_weight=1e-6)
+
+    def snap(self, locations):
+        '''
+        :param locations: list of coordinate pairs (lon,lat)
+        :return: index in csr.node_ids of the nearest node of every location
+        '''
+        locations = np.asarray(locations, dtype=float).reshape(-1, 2)
+        nearest, distances = osmnx.distance.nearest_nodes(self.G, locations[:, 0], locations[:, 1], return_dist=True)
+        far = np.flatnonzero(np.asarray(distances) > self.max_snap_distance)
+        if len(far) > 0:
+            raise ValueError(f"locations {far.tolist()} are more than {self.max_snap_distance} m from the road network")
+        return np.array([self.csr.node_index[v] for v in nearest], dtype=np.int64)
+
+    def matrices(self, locations, sources=None, destinations=None, chunk_size=64):
+        '''
+        :param locations: list of coordinate pairs (lon,lat)
+        :param sources: indices of locations to route from, all if None
+        :param destinations: indices of locations to route to, all if None
+        :param chunk_size: sources whose shortest path trees are accumulated at once, bounds memory to chunk_size x nodes
+        :return: (distances, durations), two (sources, destinations) arrays; unreachable pairs are nan
+        '''
+        snapped = self.snap(locations)
+        sources = np.arange(len(snapped)) if sources is None else np.asarray(sources, dtype=np.int64)
+        destinations = np.arange(len(snapped)) if destinations is None else np.asarray(destinations, dtype=np.int64)
+        distances = np.full((len(sources), len(destinations)), np.nan)
+        durations = np.full((len(sources), len(destinations)), np.nan)
+        targets = snapped[destinations]
+
+        #every distinct source node is searched once
+        origins, inverse = np.unique(snapped[sources], return_inverse=True)
+        for start in range(0, len(origins), chunk_size):
+            chunk = origins[start:start + chunk_size]
+            #lengths are summed along the fastest paths
+            times, _, path_lengths = self.graph.trees(chunk, self.csr.costs[:, 0])
+            path_lengths = path_lengths[:, :, 0]
+
+            selected = (inverse >= start) & (inverse < start + len(chunk))
+            local = inverse[selected] - start
+            reached = np.isfinite(times[np.ix_(local, targets)])
+            durations[selected] = np.where(reached, times[np.ix_(local, targets)], np.nan)
+            distances[selected] = np.where(reached, path_lengths[np.ix_(local, targets)]/meters_per_mile, np.nan)
+        return distances, durations
+
+    def route(self, locations):
+        '''
+        Fastest path through the locations in order.
+        :param locations: list of coordinate pairs (lon,lat)
+        :return: list of [lat, lon] points along the roads, for folium
+        '''
+        snapped = self.snap(locations)
+        points = []
+        for u, v in zip(snapped, snapped[1:]):
+            _, predecessors = csgraph.dijkstra(self.graph.matrix, indices=u, return_predecessors=True)
+            path = [v]
+            while path[-1] != u and predecessors[path[-1]] >= 0:
+                path.append(predecessors[path[-1]])
+            #the first node of every leg is the last node of the previous one
+            for w in path[::-1][1 if len(points) > 0 else 0:]:
+                node = self.G.nodes[self.csr.node_ids[w]]
+                points.append([node["y"], node["x"]])
+        return points
+
+
+def road_network(bbox, network_type, store=None):
+    '''
+    Road graph of bbox, clipped from the store when a stored graph covers it, otherwise downloaded (and stored).
+    Driving graphs get the osmnx imputed speeds and travel times.
+    :param bbox: (north, south, east, west)
+    :param network_type: osmnx network type, e.g. drive, walk or bike
+    :param store: optional osm_graph_store.GraphStore
+    '''
+    filters = [f"network_type={network_type}"]
+    G = store.get(bbox, filters) if store is not None else None
+    if G is None:
+        north, south, east, west = bbox
+        G = osmnx.graph_from_bbox(north, south, east, west, network_type=network_type)
+        if network_type == "drive":
+            G = osmnx.add_edge_travel_times(osmnx.add_edge_speeds(G))
+        if store is not None:
+            store.put(bbox, filters, G)
+    return G
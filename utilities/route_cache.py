@@ -0,0 +1,74 @@
+# Cache of multiobjective search results.
+# A one_to_all search only depends on the graph, its costs, the source and the pruning budget, so its
+# Pareto label sets can be reused whenever those repeat, e.g. when a preference is toggled back and forth.
+# Searches for combinations that were not asked for yet can be run ahead of time on a background thread.
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class RouteCache:
+    '''
+    Least recently used cache of search results with background prefetching.
+    Keys are hashable tuples, e.g. (graph fingerprint, source, budget, preferences); values are the
+    node -> labels dicts returned by one_all_mosp.one_to_all_csr. A key is never searched twice at the
+    same time: a lookup of a key that is being prefetched waits for that search instead.
+    '''
+    def __init__(self, max_entries=16, max_workers=1):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="route-cache")
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def _put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self.pending.pop(key, None)
+
+    def get(self, key, search):
+        '''
+        Cached result of key, running search() in the calling thread if it is neither cached nor being prefetched.
+        :param search: callable without arguments computing the result of key
+        '''
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            future = self.pending.get(key)
+        if future is not None:
+            try:
+                return future.result()
+            except Exception:
+                pass
+        value = search()
+        self._put(key, value)
+        return value
+
+    def prefetch(self, key, search):
+        '''
+        Runs search() for key on the background pool unless it is cached or already queued.
+        search must not touch streamlit state, the pool's threads have no script context.
+        '''
+        with self.lock:
+            if key in self.entries or key in self.pending:
+                return
+            self.pending[key] = self.pool.submit(self._prefetch, key, search)
+
+    def _prefetch(self, key, search):
+        try:
+            value = search()
+        except Exception:
+            #a failed prefetch is simply searched again when it is asked for
+            with self.lock:
+                self.pending.pop(key, None)
+            raise
+        self._put(key, value)
+        return value
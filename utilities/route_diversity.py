@@ -0,0 +1,53 @@
+# Selection of diverse running routes.
+# Routes are compared by the share of nodes they have in common. Every node id gets a dense integer index
+# and the selected routes are kept as columns of a boolean node membership matrix, so comparing a candidate
+# with all selected routes is a single row lookup instead of a list scan per pair.
+import numpy as np
+
+
+def route_similarity(routeA, routeB, same_end_penalty=.1):
+    '''
+    Share of the nodes of the shorter route that also lie on the other route, plus same_end_penalty
+    when both routes end on the same node.
+    '''
+    shared = len(set(routeA).intersection(routeB))
+    similarity = shared/min(len(routeA), len(routeB))
+    if routeA[-1] == routeB[-1]:
+        similarity += same_end_penalty
+    return similarity
+
+
+def select_diverse(routes, k, max_similarity, same_end_penalty=.1):
+    '''
+    Greedily picks up to k routes, in the given order, that are each less than max_similarity similar
+    (see route_similarity) to every route picked before them. Pass the routes sorted by cost to get the
+    k lowest cost diverse routes; routes is consumed lazily and iteration stops once k are picked.
+    :param routes: iterable of node id lists
+    :return: positions of the picked routes in routes
+    '''
+    node_index = {}
+    #owners[v, j] is True if node v lies on the j-th picked route
+    owners = np.zeros((64, k), dtype=bool)
+    sizes = np.zeros(k, dtype=np.int64)
+    ends = np.zeros(k, dtype=np.int64)
+    selected = []
+    for i, route in enumerate(routes):
+        if len(selected) == k:
+            break
+        ids = np.unique(np.fromiter((node_index.setdefault(v, len(node_index)) for v in route), dtype=np.int64, count=len(route)))
+        end = node_index[route[-1]]
+        if len(node_index) > len(owners):
+            owners = np.concatenate([owners, np.zeros((max(len(owners), len(node_index) - len(owners)), k), dtype=bool)])
+
+        m = len(selected)
+        if m > 0:
+            shared = owners[ids, :m].sum(axis=0)
+            #the shared count is over distinct nodes but, as in route_similarity, the route lengths count repeats
+            similarity = shared/np.minimum(len(route), sizes[:m]) + same_end_penalty*(ends[:m] == end)
+            if (similarity >= max_similarity).any():
+                continue
+        owners[ids, m] = True
+        sizes[m] = len(route)
+        ends[m] = end
+        selected.append(i)
+    return selected
@@ -0,0 +1,58 @@
+# Shared plumbing of the persistent SQLite caches (elevations, geocoded addresses, travel matrix pairs).
+# A cache is one table in one file; the caches are used from worker threads, so every access goes through
+# one lock and a fresh connection, and key lookups are split to stay below SQLite's limit on query parameters.
+import contextlib
+import os
+import sqlite3
+import threading
+
+#SQLite builds before 3.32 allow at most 999 parameters per query
+max_parameters = 999
+
+
+class SQLiteCache:
+    '''
+    Base of the SQLite backed caches.
+    :param schema: CREATE TABLE IF NOT EXISTS statement of the cache's table
+    '''
+    def __init__(self, path, schema):
+        self.path = path
+        self.lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory != "":
+            os.makedirs(directory, exist_ok=True)
+        with self.transaction() as connection:
+            connection.execute(schema)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        '''
+        Connection for one locked transaction, committed on success and rolled back on error.
+        '''
+        with self.lock:
+            connection = sqlite3.connect(self.path, timeout=30)
+            try:
+                with connection:
+                    yield connection
+            finally:
+                connection.close()
+
+    @staticmethod
+    def select_keys(connection, query, clause, keys, parameters=()):
+        '''
+        Rows of query for every key, in chunks of keys.
+        :param query: SELECT statement with a {} placeholder for the key condition
+        :param clause: condition matching one key, e.g. "(lat = ? AND lon = ?)"; the chunk's clauses are joined with OR
+        :param keys: distinct keys, tuples of as many values as clause has parameters (or single values)
+        :param parameters: values of the parameters of query that precede the key condition
+        '''
+        keys = [key if isinstance(key, tuple) else (key,) for key in keys]
+        if len(keys) == 0:
+            return []
+        chunk_size = max((max_parameters - len(parameters))//len(keys[0]), 1)
+        rows = []
+        for i in range(0, len(keys), chunk_size):
+            chunk = keys[i:i + chunk_size]
+            condition = " OR ".join([clause]*len(chunk))
+            rows.extend(connection.execute(query.format(condition), list(parameters) + [x for key in chunk for x in key]))
+        return rows
@@ -0,0 +1,160 @@
+# Tiled and cached travel matrices for the routing pages.
+# An N x N matrix is assembled from provider-sized source x destination tiles fetched concurrently. Every
+# pairwise distance and duration is kept in a persistent cache per traveller profile, so a repeated stop list
+# is answered without requests and adding a stop only requests its new row and column.
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from utilities import sqlite_cache
+
+
+class PairCache(sqlite_cache.SQLiteCache):
+    '''
+    Persistent (profile, origin, destination) -> (distance, duration) cache in SQLite. Coordinates are rounded
+    to 5 decimals (about a meter). Entries older than ttl_days are ignored so road changes are picked up eventually.
+    '''
+    def __init__(self, path, ttl_days=30):
+        self.ttl = ttl_days*24*60*60
+        super().__init__(path, "CREATE TABLE IF NOT EXISTS pair (profile TEXT, from_lon INTEGER, from_lat INTEGER, to_lon INTEGER, to_lat INTEGER, "
+                               "distance REAL, duration REAL, created REAL, PRIMARY KEY (profile, from_lon, from_lat, to_lon, to_lat))")
+
+    @staticmethod
+    def keys(nodes):
+        '''
+        :param nodes: list of coordinate pairs (lon,lat)
+        '''
+        return [tuple(x) for x in np.round(np.asarray(nodes, dtype=float).reshape(-1, 2)*1e5).astype(np.int64).tolist()]
+
+    def get_many(self, profile, keys):
+        '''
+        Cached entries among all pairs of keys.
+        :return: dict of (origin key, destination key) -> (distance, duration)
+        '''
+        found = {}
+        keys = list(set(keys))
+        now = time.time()
+        wanted = set(keys)
+        with self.transaction() as connection:
+            #rows are selected by origin, the destinations are filtered here
+            rows = self.select_keys(connection, "SELECT from_lon, from_lat, to_lon, to_lat, distance, duration FROM pair WHERE profile = ? AND created > ? AND ({})",
+                                    "(from_lon = ? AND from_lat = ?)", keys, (profile, now - self.ttl))
+        for from_lon, from_lat, to_lon, to_lat, distance, duration in rows:
+            if (to_lon, to_lat) in wanted:
+                found[((from_lon, from_lat), (to_lon, to_lat))] = (distance, duration)
+        return found
+
+    def put_many(self, profile, values):
+        '''
+        :param values: dict of (origin key, destination key) -> (distance, duration)
+        '''
+        now = time.time()
+        with self.transaction() as connection:
+            connection.executemany("INSERT OR REPLACE INTO pair VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                   [(profile, *origin, *destination, distance, duration, now)
+                                    for (origin, destination), (distance, duration) in values.items()])
+
+
+class MatrixService:
+    '''
+    Distance and duration matrices assembled from cached pairs and concurrently fetched tiles.
+    :param tile_size: most sources and destinations in one request, tile_size**2 pairs must be within the provider's limit
+    '''
+    def __init__(self, cache, tile_size=50, max_workers=4):
+        self.cache = cache
+        self.tile_size = tile_size
+        self.max_workers = max_workers
+
+    def _tile(self, tiles, sources, destinations):
+        for a in range(0, len(sources), self.tile_size):
+            for b in range(0, len(destinations), self.tile_size):
+                tiles.append((list(sources[a:a + self.tile_size]), list(destinations[b:b + self.tile_size])))
+
+    def tiles(self, missing):
+        '''
+        Covers the missing pairs with source x destination tiles: first the sources missing every destination,
+        then the destinations missing from every other source, then the remaining sources grouped by the
+        destinations they miss. A new stop thus costs one tile row for its origin and one tile column for its destination.
+        :param missing: boolean (n, n) matrix, the diagonal is never requested for its own sake
+        :return: list of (sources, destinations) index lists
+        '''
+        n = len(missing)
+        left = missing.copy()
+        np.fill_diagonal(left, False)
+        tiles = []
+        if not left.any():
+            return tiles
+        #a zero diagonal entry costs nothing to request along with a row or column
+        full = left | np.eye(n, dtype=bool)
+        nodes = np.arange(n)
+
+        rows = np.flatnonzero(full.all(axis=1))
+        self._tile(tiles, rows.tolist(), nodes.tolist())
+        left[rows] = False
+        others = np.setdiff1d(nodes, rows)
+        columns = np.flatnonzero(full[others].all(axis=0)) if len(others) > 0 else np.zeros(0, dtype=np.int64)
+        self._tile(tiles, others.tolist(), columns.tolist())
+        left[:, columns] = False
+
+        groups = {}
+        for i in np.flatnonzero(left.any(axis=1)):
+            groups.setdefault(tuple(np.flatnonzero(left[i]).tolist()), []).append(int(i))
+        for destinations, sources in groups.items():
+            self._tile(tiles, sources, destinations)
+        return tiles
+
+    @staticmethod
+    def _fetch_tile(fetch, profile, nodes, sources, destinations):
+        #only the tile's own locations are sent
+        locations = sorted(set(sources) | set(destinations))
+        position = {v: k for k, v in enumerate(locations)}
+        distances, durations = fetch(profile, [nodes[v] for v in locations],
+                                     [position[v] for v in sources], [position[v] for v in destinations])
+        return np.array(distances, dtype=float), np.array(durations, dtype=float)
+
+    def matrices(self, profile, nodes, fetch):
+        '''
+        :param nodes: list of coordinate pairs (lon,lat)
+        :param fetch: callable (profile, locations, sources, destinations) -> (distances, durations), the
+                      provider's matrix request with the caller's credentials for the given source and
+                      destination indices of locations. It runs on worker threads, so it must not touch streamlit state.
+        :return: (distances, durations), two (n, n) arrays; pairs the provider could not route are nan
+        '''
+        n = len(nodes)
+        keys = PairCache.keys(nodes)
+        distances = np.zeros((n, n))
+        durations = np.zeros((n, n))
+        missing = np.ones((n, n), dtype=bool)
+        np.fill_diagonal(missing, False)
+
+        #a coordinate given twice shares its cache entries
+        positions = {}
+        for i, key in enumerate(keys):
+            positions.setdefault(key, []).append(i)
+        for (origin, destination), (distance, duration) in self.cache.get_many(profile, keys).items():
+            for i in positions[origin]:
+                for j in positions[destination]:
+                    if i != j:
+                        #unroutable pairs are cached as NULL
+                        distances[i, j] = np.nan if distance is None else distance
+                        durations[i, j] = np.nan if duration is None else duration
+                        missing[i, j] = False
+
+        failed = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = [(tile, pool.submit(self._fetch_tile, fetch, profile, nodes, *tile)) for tile in self.tiles(missing)]
+            for (sources, destinations), future in futures:
+                try:
+                    tile_distances, tile_durations = future.result()
+                except Exception as error:
+                    failed.append(error)
+                    continue
+                distances[np.ix_(sources, destinations)] = tile_distances
+                durations[np.ix_(sources, destinations)] = tile_durations
+                #store every tile as it arrives so a failed tile keeps the others
+                self.cache.put_many(profile, {(keys[i], keys[j]): (tile_distances[a, b], tile_durations[a, b])
+                                              for a, i in enumerate(sources) for b, j in enumerate(destinations) if i != j})
+        if len(failed) > 0:
+            raise RuntimeError(f"{len(failed)} of {len(futures)} matrix tiles failed, the others are cached") from failed[0]
+        return distances, durations
@@ -0,0 +1,111 @@
+# Capacitated vehicle routing model for the Trip Planning page, free of streamlit so it can be benchmarked.
+# Arc costs and the unit demand of every stop are handed to OR-Tools as an integer matrix and a vector, so the
+# solver evaluates them in C++ instead of calling back into Python for every arc it looks at.
+import time
+
+import numpy as np
+from ortools.constraint_solver import pywrapcp, routing_enums_pb2
+
+
+def integer_costs(matrix, scale=1000):
+    '''
+    Integer arc cost matrix for OR-Tools. Costs are multiplied by scale and rounded, so e.g. miles keep three decimals.
+    Pairs that could not be routed (nan or None) cost more than any route made of routable arcs.
+    :param matrix: (n, n) list or array of costs
+    :return: (n, n) int64 array
+    '''
+    costs = np.array(matrix, dtype=float)*scale
+    routable = np.isfinite(costs)
+    costs = np.where(routable, np.round(costs), 0)
+    if not routable.all():
+        costs[~routable] = (costs.max() + 1)*len(costs)
+    np.fill_diagonal(costs, 0)
+    return costs.astype(np.int64)
+
+
+def build_model(costs, num_vehicles, capacity, depot=0):
+    '''
+    Routing model of a capacitated VRP in which every stop other than the depot takes one unit of capacity.
+    :param costs: (n, n) integer arc cost matrix, see integer_costs
+    :param capacity: most stops a vehicle visits
+    :return: (manager, routing)
+    '''
+    costs = np.asarray(costs, dtype=np.int64)
+    manager = pywrapcp.RoutingIndexManager(len(costs), int(num_vehicles), depot)
+    routing = pywrapcp.RoutingModel(manager)
+
+    #node indexed matrix and vector, evaluated by the solver without calling into python
+    transit_index = routing.RegisterTransitMatrix(costs.tolist())
+    routing.SetArcCostEvaluatorOfAllVehicles(transit_index)
+
+    demands = np.ones(len(costs), dtype=np.int64)
+    demands[depot] = 0
+    demand_index = routing.RegisterUnaryTransitVector(demands.tolist())
+    routing.AddDimension(demand_index, 0, int(capacity), True, 'capacity')
+    return manager, routing
+
+
+#solve modes, the metaheuristics run until the time limit, the first solution mode stops at the first solution
+metaheuristics = {
+    "guided local search": routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH,
+    "tabu search": routing_enums_pb2.LocalSearchMetaheuristic.TABU_SEARCH,
+    "simulated annealing": routing_enums_pb2.LocalSearchMetaheuristic.SIMULATED_ANNEALING,
+    "first solution": None,
+}
+
+
+def search_parameters(solution_limit=None, time_limit=None, metaheuristic="first solution",
+                      first_solution_strategy=routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC):
+    '''
+    :param time_limit: seconds, or None for no limit
+    :param metaheuristic: key of metaheuristics
+    '''
+    parameters = pywrapcp.DefaultRoutingSearchParameters()
+    parameters.first_solution_strategy = first_solution_strategy
+    if metaheuristics[metaheuristic] is None:
+        parameters.solution_limit = 1
+    else:
+        parameters.local_search_metaheuristic = metaheuristics[metaheuristic]
+    if solution_limit is not None:
+        parameters.solution_limit = solution_limit
+    if time_limit is not None:
+        parameters.time_limit.FromMilliseconds(int(time_limit*1000))
+    return parameters
+
+
+def solve(routing, time_limit, metaheuristic="guided local search",
+          first_solution_strategy=routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC):
+    '''
+    Solves the model once within time_limit seconds. Only the objective of every improving solution is
+    recorded, not the assignment, so a long search costs no memory.
+    :param metaheuristic: key of metaheuristics
+    :return: (solution or None, curve) where curve is a list of (seconds since the start, objective) per improvement
+    '''
+    curve = []
+    start = time.perf_counter()
+
+    def improvement():
+        #cost of the solution just found, the search also reports solutions that are no better
+        objective = routing.CostVar().Max()
+        if len(curve) == 0 or objective < curve[-1][1]:
+            curve.append((time.perf_counter() - start, objective))
+    routing.AddAtSolutionCallback(improvement)
+
+    solution = routing.SolveWithParameters(search_parameters(time_limit=time_limit, metaheuristic=metaheuristic,
+                                                             first_solution_strategy=first_solution_strategy))
+    return solution, curve
+
+
+def routes(manager, routing, solution):
+    '''
+    :return: list of node lists, one per vehicle, each starting and ending at the depot
+    '''
+    tours = []
+    for vehicle in range(routing.vehicles()):
+        index = routing.Start(vehicle)
+        tour = [manager.IndexToNode(index)]
+        while not routing.IsEnd(index):
+            index = solution.Value(routing.NextVar(index))
+            tour.append(manager.IndexToNode(index))
+        tours.append(tour)
+    return tours